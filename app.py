@@ -1,204 +1,245 @@
 import webview
 import os
 import base64
+import json
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
 from datetime import datetime
-from pipeline import listener
+from pipeline import get_listener
+from backend.quen3_model import feedback_cache, nl_feedback, nl_feedback_stream
+from backend.metrics import metrics
+from backend.audio import array_to_segment, load_audio, pcm16_view
+from backend.profiling import PeakRSS
+from backend.streaming import StreamingRecognizer
+from backend.viseme_assets import viseme_assets
+from backend.history_store import HistoryStore
 
-from pydub import AudioSegment
-import io
-import pickle
-import shutil
 
 # Create recordings directory if it doesn't exist
 RECORDINGS_DIR = "recordings"
 os.makedirs(RECORDINGS_DIR, exist_ok=True)
 
+# Live recordings kept in memory at once
+MAX_OPEN_STREAMS = 16
+
+# The speech model and its caches, shared by every request of the window
+listener = get_listener()
+
+# Every attempt is kept for progress tracking (written in the background)
+history = HistoryStore(os.environ.get("SPEECHTEACHER_HISTORY") or os.path.join(RECORDINGS_DIR, "history.sqlite"))
+
+
+def new_request_id():
+    """Returns a unique, filesystem-safe identifier for one recording"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{timestamp}_{uuid.uuid4().hex[:12]}"
+
+
+def recording_path(request_id):
+    """Maps a request ID to its WAV file, rejecting anything that could escape the directory"""
+    if not request_id or not all(c.isalnum() or c == "_" for c in request_id):
+        raise ValueError(f"Invalid request ID: {request_id!r}")
+    return os.path.join(RECORDINGS_DIR, f"{request_id}.wav")
+
 
 class API:
-    def save_audio(self, audio_base64, sentence="untitled"):
-        """Save audio recording to a WAV file"""
-        try:
-            if not audio_base64:
-                return {"success": False, "error": "No audio data provided"}
+    def __init__(self, window=None):
+        # Underscored so pywebview doesn't expose the window itself to JavaScript
+        self._window = window
 
-            # Remove data URL prefix if present
-            if "," in audio_base64:
-                audio_base64 = audio_base64.split(",")[1]
+        # Live recordings being transcribed while the learner speaks, by request ID
+        self._streams = OrderedDict()
+        self._streams_lock = threading.Lock()
 
-            # Decode base64 audio
-            audio_bytes = base64.b64decode(audio_base64)
+    def _push(self, function, *args):
+        """Calls a global JavaScript function in the window with JSON-encoded arguments"""
+        self._window.evaluate_js(f"{function}({', '.join(json.dumps(arg) for arg in args)})")
 
-            # Generate filename with timestamp
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            safe_sentence = "".join(c for c in sentence if c.isalnum() or c in (" ", "-", "_")).strip()
-            safe_sentence = safe_sentence[:30]  # Limit length
-            filename = f"tmp.wav"
-            filepath = os.path.join(RECORDINGS_DIR, filename)
+    def _stream_feedback(self, feedback_id, sentence, target_phonemes, user_phonemes, errors, session_id="default"):
+        """Forwards the LLM feedback to the frontend chunk by chunk as it is generated"""
+        try:
+            for chunk in nl_feedback_stream(sentence, target_phonemes, user_phonemes, errors, session_id=session_id):
+                self._push("onFeedbackChunk", feedback_id, chunk)
+            self._push("onFeedbackDone", feedback_id, None)
+        except Exception as e:
+            print(f"Error streaming feedback: {str(e)}")
+            self._push("onFeedbackDone", feedback_id, str(e))
+
+    def get_status(self):
+        """Reports whether the speech model is loaded so the frontend can show progress"""
+        return {"status": listener.status, "ready": listener.status == "ready", "error": listener.error}
 
-            # Save audio file using pydub
-            audio = AudioSegment.from_file(io.BytesIO(audio_bytes))
-            audio.export(filepath, format="wav")
+    def get_metrics(self):
+        """Latency percentiles (seconds) per pipeline stage, plus cache hit rates"""
+        return {
+            "spans": metrics.summary(),
+            "caches": {
+                "pronunciations": listener.pronunciations.stats(),
+                "feedback": feedback_cache.stats(),
+            },
+        }
 
-            print(f"Audio saved: {filepath}")
+    def get_viseme_manifest(self, version=None):
+        """
+        All viseme images as data URLs keyed by ID; corrections only reference the IDs.
+        Pass the `version` the frontend already has to skip resending unchanged images.
+        """
+        try:
+            manifest = viseme_assets.manifest()
+            if version == manifest["version"]:
+                return {"success": True, "version": version, "unchanged": True}
+            return {"success": True, **manifest}
+        except Exception as e:
+            print(f"Error loading viseme images: {str(e)}")
+            return {"success": False, "error": str(e)}
 
+    def get_progress(self, learner="default", days=30):
+        """Most-missed phonemes and daily scores over the last `days` days"""
+        try:
             return {
                 "success": True,
-                "filename": filename,
-                "filepath": filepath,
-                "message": "Audio saved successfully",
+                "most_missed": history.most_missed_phonemes(learner, days),
+                "daily": history.daily_scores(learner, days),
             }
+        except Exception as e:
+            print(f"Error reading progress: {str(e)}")
+            return {"success": False, "error": str(e)}
 
+    def prepare_lesson(self, sentences):
+        """Pre-phonemizes a lesson's sentences so later attempts skip eSpeak-NG entirely"""
+        try:
+            warmed = listener.prephonemize(sentences)
+            return {"success": True, "warmed": warmed, "cache": listener.pronunciations.stats()}
         except Exception as e:
-            print(f"Error saving audio: {str(e)}")
+            print(f"Error preparing lesson: {str(e)}")
             return {"success": False, "error": str(e)}
 
-    def analyze_audio(self, audio_base64, sentence):
-        """Placeholder for AI analysis endpoint"""
+    def _archive(self, segment, request_id):
+        """Writes an already decoded recording to its own file in the recordings directory"""
+        filepath = recording_path(request_id)
+        segment.export(filepath, format="wav")
+        print(f"Audio saved: {filepath}")
+        return os.path.basename(filepath), filepath
+
+    def start_stream(self):
+        """Opens a live recording whose phonemes are recognized while the learner speaks"""
+        request_id = new_request_id()
+        with self._streams_lock:
+            self._streams[request_id] = StreamingRecognizer(listener)
+            # Abandoned streams (e.g. a closed window) shouldn't pile up
+            while len(self._streams) > MAX_OPEN_STREAMS:
+                self._streams.popitem(last=False)
+        return {"success": True, "request_id": request_id}
+
+    def _stream(self, request_id):
+        with self._streams_lock:
+            if request_id not in self._streams:
+                raise KeyError(f"Unknown stream: {request_id}")
+            return self._streams[request_id]
+
+    def push_stream_chunk(self, request_id, pcm_base64):
+        """
+        Appends 16 kHz 16-bit PCM to a live recording and returns the partial phonemes.
+        The bridge only carries JSON, so the bytes arrive base64-encoded; they are then
+        read in place as int16 and scaled once, into the recording's own buffer.
+        """
+        try:
+            partial = self._stream(request_id).push(pcm16_view(base64.b64decode(pcm_base64)))
+            return {"success": True, "partial": partial}
+        except Exception as e:
+            print(f"Error streaming audio: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    def finish_stream(self, request_id):
+        """Transcribes the rest of a live recording once the learner stops speaking"""
+        try:
+            return {"success": True, "user_phonemes": self._stream(request_id).finish()}
+        except Exception as e:
+            print(f"Error finishing stream: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    def analyze_audio(self, request_id, sentence, archive=False, learner="default"):
+        """
+        Runs the analysis pipeline on one attempt.
+        The audio is the PCM recording opened with `start_stream` under `request_id`
+        (the only upload path), or a recording archived earlier under that ID.
+        Live recordings are only written to disk when `archive` is set.
+        The result is added to `learner`'s history, and the coaching continues
+        `learner`'s own conversation with the LLM.
+        """
         sentence = sentence.strip()
 
         try:
-            filename = f"tmp.wav"
-            filepath = os.path.join(RECORDINGS_DIR, filename)
-            score, substituted, inserted, deleted, conversation, target_phonemes, user_phonemes = listener(
-                sentence, filepath
-            )
-            # with open("out.pkl", "w") as f:
-            #     pickle.dumps((score, substituted, inserted, deleted, conversation), f)
+            start = time.perf_counter()
+            user_phonemes = None
+            with self._streams_lock:
+                stream = self._streams.pop(request_id, None) if request_id else None
+
+            if stream is not None:
+                # Already transcribed while recording; only the tail may still need the model
+                stream.finish()
+                user_phonemes = stream.spans()
+                speech = stream.audio
+                if archive:
+                    self._archive(array_to_segment(speech), request_id)
+            elif request_id:
+                speech = load_audio(recording_path(request_id))
+            else:
+                return {"success": False, "error": "No audio data provided"}
+            timings = {"decode": time.perf_counter() - start}
+
+            with PeakRSS() as memory:
+                score, substituted, inserted, deleted, target_phonemes, user_phonemes, errors = listener.analyze(
+                    sentence, speech, timings, user_phonemes
+                )
+            metrics.record('request_peak_rss_mb', memory.peak_mb)
+            print("Timings: " + ", ".join(f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in timings.items()))
+            print(f"Memory: peak {memory.peak_mb:.0f} MB (from {memory.start_mb:.0f} MB)")
+
+            # The coaching text is streamed to the window afterwards when a push channel exists
+            feedback_id = None
+            if self._window is not None:
+                feedback_id = uuid.uuid4().hex
+                conversation = ""
+                threading.Thread(
+                    target=self._stream_feedback,
+                    args=(feedback_id, sentence, target_phonemes, user_phonemes, errors, learner),
+                    daemon=True,
+                ).start()
+            else:
+                conversation = nl_feedback(sentence, target_phonemes, user_phonemes, errors, session_id=learner)
             print(score, substituted, inserted, deleted, conversation)
 
             corrections = substituted + deleted
-
-            # Normalize viseme paths to absolute file:/// URIs so the webview can load them reliably
-            # for c in corrections:
-            #     try:
-            #         if not isinstance(c, dict):
-            #             continue
-            #         # support either 'viseme_img_path' or older 'viseme_path' keys
-            #         img_path = c.get("viseme_img_path") or c.get("viseme_path")
-            #         if not img_path:
-            #             continue
-
-            #         # If already looks like a file URI, leave it and ensure canonical key exists
-            #         if isinstance(img_path, str) and img_path.startswith("file:///"):
-            #             print(f"Viseme file URI already: {img_path}")
-            #             c["viseme_img_path"] = img_path
-            #             continue
-
-            #         # Resolve to absolute path
-            #         abs_path = os.path.abspath(img_path)
-            #         resolved = None
-            #         if os.path.exists(abs_path):
-            #             resolved = abs_path
-            #         else:
-            #             # Try common alternative locations under the repo
-            #             candidates = [
-            #                 os.path.join(os.getcwd(), img_path),
-            #                 os.path.join(os.getcwd(), "viseme_feedback", img_path),
-            #                 os.path.join(
-            #                     os.getcwd(), "viseme_feedback", "visemes", os.path.basename(img_path)
-            #                 ),
-            #                 os.path.join(os.getcwd(), "viseme_feedback", "visemes", img_path),
-            #             ]
-            #             for cand in candidates:
-            #                 if os.path.exists(cand):
-            #                     resolved = cand
-            #                     break
-
-            #         if resolved:
-            #             # Attempt to make the image available to the frontend as a relative path
-            #             frontend_dir = os.path.join(os.getcwd(), "frontend")
-            #             frontend_visemes_dir = os.path.join(frontend_dir, "visemes")
-            #             os.makedirs(frontend_visemes_dir, exist_ok=True)
-
-            #             try:
-            #                 abs_frontend = os.path.abspath(frontend_dir)
-            #                 abs_resolved = os.path.abspath(resolved)
-            #                 # If resolved file is already inside frontend, use a frontend-relative path
-            #                 if abs_resolved.startswith(abs_frontend + os.sep):
-            #                     rel = os.path.relpath(abs_resolved, abs_frontend).replace("\\", "/")
-            #                     c["viseme_img_path"] = rel
-            #                     print(f"Using frontend-relative viseme path: {rel}")
-            #                     # Also embed the image as base64 data so the frontend can render it
-            #                     try:
-            #                         with open(abs_resolved if abs_resolved else resolved, "rb") as f:
-            #                             img_bytes = f.read()
-            #                         b64 = base64.b64encode(img_bytes).decode("ascii")
-            #                         _, ext = os.path.splitext(resolved)
-            #                         ext = ext.lower()
-            #                         if ext in (".jpg", ".jpeg"):
-            #                             mime = "image/jpeg"
-            #                         elif ext == ".png":
-            #                             mime = "image/png"
-            #                         elif ext == ".gif":
-            #                             mime = "image/gif"
-            #                         elif ext == ".svg":
-            #                             mime = "image/svg+xml"
-            #                         else:
-            #                             mime = "application/octet-stream"
-            #                         c["viseme_img_data"] = f"data:{mime};base64," + b64
-            #                     except Exception as embed_ex:
-            #                         print(f"Failed to embed viseme image as base64: {embed_ex}")
-            #                 else:
-            #                     # Copy into frontend/visemes so it can be referenced relatively
-            #                     dest_name = os.path.basename(resolved)
-            #                     dest_path = os.path.join(frontend_visemes_dir, dest_name)
-            #                     if os.path.exists(dest_path):
-            #                         base, ext = os.path.splitext(dest_name)
-            #                         dest_name = f"{base}_{int(datetime.now().timestamp())}{ext}"
-            #                         dest_path = os.path.join(frontend_visemes_dir, dest_name)
-            #                     shutil.copy2(resolved, dest_path)
-            #                     rel = os.path.relpath(dest_path, abs_frontend).replace("\\", "/")
-            #                     c["viseme_img_path"] = rel
-            #                     print(f"Copied viseme into frontend: {rel}")
-            #                     # Embed the copied image as base64 as well
-            #                     try:
-            #                         with open(dest_path, "rb") as f:
-            #                             img_bytes = f.read()
-            #                         b64 = base64.b64encode(img_bytes).decode("ascii")
-            #                         _, ext = os.path.splitext(dest_path)
-            #                         ext = ext.lower()
-            #                         if ext in (".jpg", ".jpeg"):
-            #                             mime = "image/jpeg"
-            #                         elif ext == ".png":
-            #                             mime = "image/png"
-            #                         elif ext == ".gif":
-            #                             mime = "image/gif"
-            #                         elif ext == ".svg":
-            #                             mime = "image/svg+xml"
-            #                         else:
-            #                             mime = "application/octet-stream"
-            #                         c["viseme_img_data"] = f"data:{mime};base64," + b64
-            #                     except Exception as embed_ex:
-            #                         print(f"Failed to embed copied viseme image as base64: {embed_ex}")
-            #             except Exception as copy_ex:
-            #                 # Fallback: file URI
-            #                 abs_path_slash = resolved.replace("\\", "/")
-            #                 file_uri = "file:///" + abs_path_slash
-            #                 c["viseme_img_path"] = file_uri
-            #                 print(f"Failed to copy viseme; using file URI: {file_uri} (error: {copy_ex})")
-            #         else:
-            #             # If path doesn't exist, leave original but log
-            #             print(f"Viseme path not found: {img_path} -> abs: {abs_path}")
-            #     except Exception as ex:
-            #         print(f"Error normalizing viseme path: {ex}")
-            #         # If anything goes wrong normalizing, leave original path
+            history.record(learner, sentence, target_phonemes, user_phonemes, score, corrections + inserted, timings)
 
             return {
                 "success": True,
+                "request_id": request_id,
                 "sentence": target_phonemes,
                 "user_phonemes": user_phonemes,
                 "corrections": corrections,
                 "message": conversation,
+                "feedback_id": feedback_id,
+                "timings": timings,
+                "memory": memory.report(),
                 "score": score,
             }
 
         except Exception as e:
-            print(e.with_traceback())
+            traceback.print_exc()
             print(f"Error analyzing audio: {str(e)}")
             return {"success": False, "error": str(e)}
 
 
 if __name__ == "__main__":
+    # Load the model and the viseme images in the background while the window comes up
+    listener.start_loading()
+    threading.Thread(target=viseme_assets.load, daemon=True).start()
+
     api = API()
     window = webview.create_window(
         "Speech Teacher",
@@ -208,7 +249,13 @@ if __name__ == "__main__":
         resizable=True,
     )
 
+    api._window = window
+
     def on_ready():
         window.maximize()
 
-    webview.start(on_ready)
+    try:
+        webview.start(on_ready)
+    finally:
+        # The history writer is a daemon thread, so attempts still queued would be lost on exit
+        history.flush()
@@ -0,0 +1,133 @@
+import numpy as np
+
+from backend.phonemes import PhonemeString, substitution_matrix
+
+# Every phoneme costs the same to drop or add; substitutions are weighted by phonetic distance
+DELETION_COST = 1.0
+INSERTION_COST = 1.0
+
+# Backpointers of the dynamic programming table
+DIAGONAL, UP, LEFT = 0, 1, 2
+
+
+class Alignment:
+    """
+    Result of aligning a learner's phonemes against the target pronunciation.
+
+    The spans are packed like `Listener.get_misalignments` always did,
+    `((ref_start, ref_end), (user_start, user_end))`, as character offsets into the
+    two strings so the frontend can keep slicing them. `target` and `user` are the
+    tokenized strings, for callers that need the phonemes behind a span.
+    """
+    def __init__(self, similarity, cost, matches, substitutions, deletions, insertions, target, user):
+        self.similarity = similarity
+        self.cost = cost
+        self.matches = matches
+        self.substitutions = substitutions
+        self.deletions = deletions
+        self.insertions = insertions
+        self.target = target
+        self.user = user
+
+    @property
+    def word_spans(self):
+        """`(start, end)` character range of every target word, when words were given"""
+        return self.target.word_spans
+
+    def words_of(self, ref_start, ref_end):
+        """Indices `(first, last)` of the target words touched by a reference span, or None"""
+        return self.target.words_of(ref_start, ref_end)
+
+
+def _cost_table(target_ids, user_ids):
+    """
+    Fills the weighted edit distance table one row at a time. Within a row, the
+    insertion chain is the only sequential dependency; it is resolved with a running
+    minimum over `E[k] - C[k]`, where C is the cumulative insertion cost, so every row
+    is a handful of NumPy operations. Returns the total cost and the backpointers.
+    """
+    n, m = len(target_ids), len(user_ids)
+    vocabulary, local = np.unique(np.concatenate([target_ids, user_ids]), return_inverse=True)
+    costs = substitution_matrix(vocabulary)
+    target_local, user_local = local[:n], local[n:]
+
+    cumulative = np.concatenate([[0.0], np.cumsum(np.full(m, INSERTION_COST))])
+    row = cumulative.copy()
+    pointers = np.empty((n, m + 1), dtype=np.uint8)
+
+    for i in range(n):
+        up = row + DELETION_COST
+        diagonal = row[:-1] + costs[target_local[i], user_local]
+        best = up.copy()
+        best[1:] = np.minimum(up[1:], diagonal)
+        pointers[i] = UP
+        pointers[i, 1:][diagonal <= up[1:]] = DIAGONAL
+
+        shifted = best - cumulative
+        running = np.minimum.accumulate(shifted)
+        pointers[i][shifted > running] = LEFT
+        row = running + cumulative
+
+    return float(row[-1]), pointers
+
+
+def _traceback(pointers, target_ids, user_ids):
+    """Walks the backpointers into opcodes over token indices, merging runs of the same kind"""
+    i, j = len(target_ids), len(user_ids)
+    steps = []
+    while i > 0 or j > 0:
+        move = pointers[i - 1, j] if i > 0 else LEFT
+        if move == DIAGONAL:
+            i, j = i - 1, j - 1
+            steps.append(('equal' if target_ids[i] == user_ids[j] else 'replace', i, j))
+        elif move == UP:
+            i -= 1
+            steps.append(('delete', i, j))
+        else:
+            j -= 1
+            steps.append(('insert', i, j))
+
+    opcodes = []
+    for op, i, j in reversed(steps):
+        i_end = i + (op != 'insert')
+        j_end = j + (op != 'delete')
+        if opcodes and opcodes[-1][0] == op:
+            opcodes[-1][2], opcodes[-1][4] = i_end, j_end
+        else:
+            opcodes.append([op, i, i_end, j, j_end])
+    return opcodes
+
+
+def _char_span(phonemes, first, last):
+    """Character range covered by tokens `[first, last)`, or the insertion point if empty"""
+    if last > first:
+        return int(phonemes.starts[first]), int(phonemes.ends[last - 1])
+    position = int(phonemes.starts[first]) if first < len(phonemes) else len(phonemes.text)
+    return position, position
+
+
+def align(target_phonemes, user_phonemes, target_words=None):
+    """
+    Aligns two IPA strings phoneme by phoneme rather than character by character.
+
+    Multi-character phonemes (`aɪ`, `tʃ`, `iː`) are single tokens, stress marks and
+    spaces are ignored, and substitutions between similar phonemes cost less than
+    unrelated ones. Either side may be an already tokenized PhonemeString.
+    `target_words` (the target split into words, concatenating to `target_phonemes`)
+    adds word-level spans to the result.
+    """
+    target = target_phonemes if isinstance(target_phonemes, PhonemeString) else PhonemeString(target_phonemes, target_words)
+    user = user_phonemes if isinstance(user_phonemes, PhonemeString) else PhonemeString(user_phonemes)
+
+    cost, pointers = _cost_table(target.ids, user.ids)
+    longest = max(len(target), len(user))
+    similarity = round(100 - cost / longest * 100) if longest else 100
+
+    spans = {'equal': [], 'replace': [], 'delete': [], 'insert': []}
+    for op, i_start, i_end, j_start, j_end in _traceback(pointers, target.ids, user.ids):
+        spans[op].append((
+            _char_span(target, i_start, i_end),
+            _char_span(user, j_start, j_end),
+        ))
+
+    return Alignment(max(similarity, 0), cost, spans['equal'], spans['replace'], spans['delete'], spans['insert'], target, user)
@@ -0,0 +1,105 @@
+import io
+import os
+
+import librosa
+import numpy as np
+from pydub import AudioSegment
+
+from backend.metrics import metrics
+
+SAMPLE_RATE = 16_000
+
+# --------------------------
+# Decoding
+# --------------------------
+def segment_to_array(segment, sr=SAMPLE_RATE):
+    """Converts a pydub AudioSegment into a mono float32 waveform at `sr`"""
+    segment = segment.set_channels(1).set_frame_rate(sr)
+    samples = np.frombuffer(segment.raw_data, dtype=f"<i{segment.sample_width}")
+    # Scale the integer PCM range into [-1, 1]
+    return samples.astype(np.float32) / float(1 << (8 * segment.sample_width - 1))
+
+
+def decode_audio(audio_bytes, sr=SAMPLE_RATE):
+    """Decodes an encoded audio buffer (webm, wav, ...) into a float32 waveform"""
+    with metrics.span("audio_decode"):
+        segment = AudioSegment.from_file(io.BytesIO(audio_bytes))
+        return segment_to_array(segment, sr), segment
+
+
+def load_audio(audio, sr=SAMPLE_RATE):
+    """
+    Returns a mono float32 waveform at `sr` from any supported source:
+    a decoded waveform (assumed to already be at `sr`), an encoded bytes buffer
+    or a path to an audio file.
+    """
+    if isinstance(audio, np.ndarray):
+        return np.ascontiguousarray(audio, dtype=np.float32)
+    if isinstance(audio, (bytes, bytearray, memoryview)):
+        speech, _ = decode_audio(bytes(audio), sr)
+        return speech
+    if isinstance(audio, (str, os.PathLike)):
+        with metrics.span("audio_decode"):
+            speech, _ = librosa.load(audio, sr=sr, mono=True)
+        return speech
+    raise TypeError(f"Unsupported audio source: {type(audio).__name__}")
+
+
+def normalize(speech):
+    """Peak-normalizes a waveform, leaving silent clips untouched"""
+    if speech.size == 0:
+        return speech
+    return librosa.util.normalize(speech)
+
+
+# --------------------------
+# Raw PCM
+# --------------------------
+def pcm16_view(pcm_bytes):
+    """Little-endian 16-bit PCM as an int16 array sharing the buffer's memory (no copy)"""
+    return np.frombuffer(pcm_bytes, dtype="<i2")
+
+
+def pcm16_to_array(pcm_bytes):
+    """Interprets little-endian 16-bit PCM as a float32 waveform in [-1, 1]"""
+    return pcm16_view(pcm_bytes).astype(np.float32) / 32768.0
+
+
+def array_to_segment(speech, sr=SAMPLE_RATE):
+    """Wraps a float32 waveform into a 16-bit pydub AudioSegment, e.g. to archive it"""
+    pcm = (np.clip(speech, -1.0, 1.0) * 32767).astype("<i2")
+    return AudioSegment(data=pcm.tobytes(), sample_width=2, frame_rate=sr, channels=1)
+
+
+# --------------------------
+# Voice activity
+# --------------------------
+def trim_silence(speech, sr=SAMPLE_RATE, top_db=35, margin=0.15):
+    """
+    Energy-based trimming of leading and trailing silence.
+    Frames quieter than `top_db` below the loudest frame are dropped from both ends,
+    keeping `margin` seconds around the speech. Returns `(trimmed, start, end)`.
+    """
+    if speech.size == 0 or not np.any(speech):
+        return speech[:0], 0, 0
+    _, (start, end) = librosa.effects.trim(speech, top_db=top_db, frame_length=512, hop_length=128)
+    pad = int(margin * sr)
+    start, end = max(start - pad, 0), min(end + pad, len(speech))
+    return speech[start:end], start, end
+
+
+def split_long_clip(speech, max_samples, sr=SAMPLE_RATE, search=1.0):
+    """Cuts a waveform into pieces of at most `max_samples`, at the quietest 20 ms near each limit"""
+    frame = int(0.02 * sr)
+    pieces = []
+    start = 0
+    while len(speech) - start > max_samples:
+        # Look for a pause within the last `search` seconds before the limit
+        low = max(start + max_samples - int(search * sr), start + frame)
+        high = start + max_samples
+        energy = np.convolve(speech[low:high] ** 2, np.ones(frame), mode="valid")
+        cut = low + int(np.argmin(energy)) + frame // 2
+        pieces.append(speech[start:cut])
+        start = cut
+    pieces.append(speech[start:])
+    return pieces
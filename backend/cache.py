@@ -0,0 +1,89 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Size-bounded, thread-safe LRU cache with an optional SQLite tier on disk.
+    Values must be JSON serializable. Entries evicted from memory stay on disk,
+    so the disk tier also makes the cache survive restarts.
+    """
+    def __init__(self, maxsize=1024, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.db = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self.db.commit()
+
+    def _remember(self, key, value):
+        """Inserts into the memory tier, evicting the least recently used entries"""
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def get(self, key, default=None):
+        """Returns the cached value, looking in memory first and on disk second"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+            if self.db is not None:
+                row = self.db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._remember(key, value)
+                    self.hits += 1
+                    return value
+
+            self.misses += 1
+            return default
+
+    def __contains__(self, key):
+        with self.lock:
+            if key in self.entries:
+                return True
+            if self.db is None:
+                return False
+            return self.db.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    def set(self, key, value):
+        self.set_many([(key, value)])
+
+    def set_many(self, items):
+        """Stores several entries at once, in a single disk transaction"""
+        items = list(items)
+        with self.lock:
+            for key, value in items:
+                self._remember(key, value)
+            if self.db is not None:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO entries (key, value) VALUES (?, ?)",
+                    [(key, json.dumps(value, ensure_ascii=False)) for key, value in items],
+                )
+                self.db.commit()
+
+    def stats(self):
+        """Hit/miss counters and memory occupancy"""
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+            }
@@ -0,0 +1,137 @@
+import numpy as np
+import torch
+
+from backend.audio import SAMPLE_RATE
+
+# wav2vec2 emits one CTC frame every 320 samples (20 ms at 16 kHz)
+FRAME_SAMPLES = 320
+FRAME_SECONDS = FRAME_SAMPLES / SAMPLE_RATE
+
+
+def log_posteriors(logits):
+    """Frame log-posteriors of a `[batch, frames, vocab]` logits tensor, as a float32 NumPy array"""
+    return torch.log_softmax(logits.float(), dim=-1).numpy()
+
+
+def best_path(log_probs):
+    """
+    Greedy CTC labels of `[..., frames, vocab]` log-posteriors, with the posterior
+    probability of each chosen label. Returns two `[..., frames]` NumPy arrays.
+    """
+    ids = log_probs.argmax(axis=-1)
+    best = np.take_along_axis(log_probs, ids[..., None], axis=-1)[..., 0]
+    return ids, np.exp(best)
+
+
+class PhonemeSpans:
+    """
+    Time-aligned phonemes of one transcription, stored as parallel arrays:
+    vocabulary `ids`, `start` and `end` frames (end exclusive) and the mean
+    posterior `confidence` of the frames of each phoneme. `vocabulary` maps
+    IDs back to the model's phoneme tokens.
+
+    The `[frames, vocab]` `log_probs` of the forward pass can be kept alongside, with
+    the recording frame of every row in `frames`, so the attempt can be scored
+    against the target later (see backend.gop) without running the model again.
+    """
+    def __init__(self, ids, start, end, confidence, vocabulary, log_probs=None, frames=None):
+        self.ids = np.asarray(ids, dtype=np.int32)
+        self.start = np.asarray(start, dtype=np.int32)
+        self.end = np.asarray(end, dtype=np.int32)
+        self.confidence = np.asarray(confidence, dtype=np.float32)
+        self.vocabulary = vocabulary
+        self.log_probs = log_probs
+        self.frames = frames
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_frames(cls, ids, confidence, blank_id, vocabulary, offset=0, log_probs=None):
+        """
+        Collapses frame labels into phoneme spans in one vectorized pass: runs of the
+        same label are found from the positions where the label changes, and blank
+        runs are dropped. `offset` (in frames) shifts the spans, e.g. past trimmed silence.
+        """
+        ids = np.asarray(ids)
+        frames = np.arange(len(ids), dtype=np.int32) + offset if log_probs is not None else None
+        if len(ids) == 0:
+            return cls([], [], [], [], vocabulary, log_probs, frames)
+        starts = np.flatnonzero(np.concatenate([[True], ids[1:] != ids[:-1]]))
+        ends = np.append(starts[1:], len(ids))
+        labels = ids[starts]
+        mean_confidence = np.add.reduceat(np.asarray(confidence, dtype=np.float64), starts) / (ends - starts)
+        keep = labels != blank_id
+        return cls(labels[keep], starts[keep] + offset, ends[keep] + offset, mean_confidence[keep], vocabulary,
+                   log_probs, frames)
+
+    @classmethod
+    def empty(cls, vocabulary):
+        return cls([], [], [], [], vocabulary)
+
+    @classmethod
+    def concatenate(cls, spans, vocabulary):
+        if not spans:
+            return cls.empty(vocabulary)
+        # Posteriors are only kept when every part has them
+        with_posteriors = all(s.log_probs is not None for s in spans)
+        return cls(
+            np.concatenate([s.ids for s in spans]),
+            np.concatenate([s.start for s in spans]),
+            np.concatenate([s.end for s in spans]),
+            np.concatenate([s.confidence for s in spans]),
+            vocabulary,
+            np.concatenate([s.log_probs for s in spans]) if with_posteriors else None,
+            np.concatenate([s.frames for s in spans]) if with_posteriors else None,
+        )
+
+    def shift(self, frames):
+        """Moves every span (and posterior frame) `frames` later in the recording"""
+        self.start += frames
+        self.end += frames
+        if self.frames is not None:
+            self.frames += frames
+
+    @property
+    def tokens(self):
+        return [self.vocabulary[i] for i in self.ids]
+
+    def text(self):
+        """The phoneme string, space-separated like the tokenizer's decode"""
+        return " ".join(self.tokens)
+
+    def char_offsets(self):
+        """`(starts, ends)` character offsets of every phoneme in `text()`"""
+        lengths = np.array([len(token) for token in self.tokens], dtype=np.int64)
+        starts = np.concatenate([[0], np.cumsum(lengths + 1)[:-1]]) if len(lengths) else lengths
+        return starts, starts + lengths
+
+    def seconds(self):
+        """`(start, end)` of every phoneme in seconds from the beginning of the recording"""
+        return self.start * FRAME_SECONDS, self.end * FRAME_SECONDS
+
+    def locate(self, char_start, char_end):
+        """
+        Time range in seconds of the phonemes covering `[char_start, char_end)` of
+        `text()`. An empty range (e.g. where a phoneme is missing) gives the gap between
+        its neighbours. Returns None when there are no phonemes at all.
+        """
+        if len(self) == 0:
+            return None
+        starts, ends = self.char_offsets()
+        first = int(np.searchsorted(ends, char_start, side='right'))
+        last = int(np.searchsorted(starts, char_end, side='left'))
+        if last > first:
+            return float(self.start[first] * FRAME_SECONDS), float(self.end[last - 1] * FRAME_SECONDS)
+        before = self.end[first - 1] if first > 0 else self.start[0]
+        after = self.start[first] if first < len(self) else self.end[-1]
+        return float(before * FRAME_SECONDS), float(max(after, before) * FRAME_SECONDS)
+
+    def to_dict(self):
+        start, end = self.seconds()
+        return {
+            "phonemes": self.tokens,
+            "start": start.round(3).tolist(),
+            "end": end.round(3).tolist(),
+            "confidence": self.confidence.astype(np.float64).round(3).tolist(),
+        }
@@ -0,0 +1,249 @@
+import math
+import re
+
+import numpy as np
+
+from backend.ctc import FRAME_SECONDS
+
+# A target phoneme whose posterior averages under ~20% of the best competing phoneme
+# over its aligned frames is reported as mispronounced
+GOP_THRESHOLD = math.log(0.2)
+
+# Diacritics that belong to the character before them
+_MODIFIERS = 'ːˑ̩̥̃̆'
+
+
+class LabelMap:
+    """
+    Maps target phoneme tokens (backend.phonemes) onto the acoustic model's CTC labels.
+
+    A multi-character token can be spelled more than one way: with the model's own
+    label for it, or with the labels of its parts (the model may emit `ts` as `t s`
+    even though its vocabulary has a `ts`). Every spelling is kept and the forced
+    alignment picks the one the recording supports. Tokens without a label of their own
+    are split into the longest labels the model does have; characters without any
+    label are dropped.
+    """
+    def __init__(self, vocabulary, blank_id):
+        self.blank_id = blank_id
+        self.label_ids = {
+            token: i for i, token in enumerate(vocabulary)
+            if i != blank_id and token and not token.startswith('<') and not token.isspace()
+        }
+        self.longest = max((len(token) for token in self.label_ids), default=1)
+        self.cache = {}
+
+    def _longest_match(self, text):
+        labels, i = [], 0
+        while i < len(text):
+            for size in range(min(self.longest, len(text) - i), 0, -1):
+                if text[i:i + size] in self.label_ids:
+                    labels.append(self.label_ids[text[i:i + size]])
+                    i += size
+                    break
+            else:
+                i += 1
+        return tuple(labels)
+
+    def token_labels(self, token):
+        """
+        Alternative label sequences of one phoneme token: its longest match and, when
+        different, one match per character (with its diacritics). Empty when the model
+        has no label for any of it.
+        """
+        spellings = self.cache.get(token)
+        if spellings is None:
+            whole = self._longest_match(token)
+            parts = tuple(
+                label
+                for part in re.findall(f"[^{_MODIFIERS}][{_MODIFIERS}]*", token)
+                for label in self._longest_match(part)
+            )
+            spellings = tuple(spelling for spelling in dict.fromkeys([whole, parts]) if spelling)
+            self.cache[token] = spellings
+        return spellings
+
+    def encode(self, phonemes):
+        """Alternative label sequences of every token of a PhonemeString, in order"""
+        return [self.token_labels(token) for token in phonemes.tokens]
+
+
+def _trellis(spellings, blank_id):
+    """
+    CTC states of a target whose tokens each have one or more label sequences.
+
+    Every spelling is a chain of its labels with optional blanks between them, and
+    a token's spellings run in parallel between the blank before it and the one after
+    it. Returns the label and target token (-1 for blanks) of every state, the
+    predecessors of every state as a `[K, states]` matrix (the first row is the state
+    itself, missing ones point one past the last state) and the states a path can
+    start and end in.
+    """
+    labels, owners, predecessors = [blank_id], [-1], [[0]]
+
+    def add(label, owner, before):
+        labels.append(label)
+        owners.append(owner)
+        predecessors.append([len(labels) - 1] + before)
+        return len(labels) - 1
+
+    # States the next token is entered from, with their label (None for blanks);
+    # a label can't directly follow the same label, there has to be a blank in between
+    entries = [(0, None)]
+    starts = None
+    for index, token_spellings in enumerate(spellings):
+        exits = []
+        for spelling in token_spellings:
+            state = add(spelling[0], index, [s for s, label in entries if label != spelling[0]])
+            for previous_label, label in zip(spelling, spelling[1:]):
+                gap = add(blank_id, -1, [state])
+                state = add(label, index, [gap] + ([state] if label != previous_label else []))
+            exits.append((state, spelling[-1]))
+        if not exits:
+            continue
+        if starts is None:
+            starts = [0] + [s for s in range(1, len(labels)) if 0 in predecessors[s][1:]]
+        boundary = add(blank_id, -1, [s for s, _ in exits])
+        entries = [(boundary, None)] + exits
+
+    if starts is None:
+        return None
+    size = len(labels)
+    matrix = np.full((max(len(p) for p in predecessors), size), size, dtype=np.int64)
+    for state, before in enumerate(predecessors):
+        matrix[:len(before), state] = before
+    return (np.array(labels, dtype=np.int64), np.array(owners, dtype=np.int64), matrix,
+            np.array(starts, dtype=np.int64), np.array([s for s, _ in entries], dtype=np.int64))
+
+
+def forced_align(log_probs, spellings, blank_id):
+    """
+    CTC Viterbi alignment of a target against `[frames, vocab]` log-posteriors.
+
+    `spellings` holds the alternative label sequences of every target token
+    (LabelMap.encode). The trellis is filled one frame at a time, each frame being a
+    handful of NumPy operations over all states. Returns `(tokens, labels)`, the target
+    token (-1 for blank frames) and the label of every frame, or None when the
+    recording is too short to hold the target.
+    """
+    trellis = _trellis(spellings, blank_id)
+    frames = len(log_probs)
+    if frames == 0 or trellis is None:
+        return None
+    labels, owners, predecessors, starts, ends = trellis
+    size = len(labels)
+
+    emissions = log_probs[:, labels]
+    # One extra state that stays unreachable stands in for missing predecessors
+    score = np.full(size + 1, -np.inf)
+    score[starts] = emissions[0, starts]
+    pointers = np.zeros((frames, size), dtype=np.uint8)
+    columns = np.arange(size)
+
+    for t in range(1, frames):
+        candidates = score[predecessors]
+        best = candidates.argmax(axis=0)
+        pointers[t] = best
+        score[:size] = candidates[best, columns] + emissions[t]
+
+    state = int(ends[np.argmax(score[ends])])
+    if not np.isfinite(score[state]):
+        return None
+
+    path = np.empty(frames, dtype=np.int64)
+    for t in range(frames - 1, -1, -1):
+        path[t] = state
+        state = int(predecessors[pointers[t, state], state])
+    return owners[path], labels[path]
+
+
+class PronunciationScores:
+    """
+    Goodness of pronunciation of every target phoneme, from the attempt's forced alignment.
+
+    `gop` is the mean over a phoneme's aligned frames of its log-posterior minus the
+    best non-blank log-posterior: 0 when the model heard exactly that phoneme, more
+    negative the more another phoneme was preferred. `posterior` is the mean posterior
+    probability of the phoneme, and `start` and `end` are its frames in the recording.
+    Phonemes the model has no label for (or that got no frames) have NaN scores.
+    """
+    def __init__(self, target, gop, posterior, start, end, threshold=GOP_THRESHOLD):
+        self.target = target
+        self.gop = gop
+        self.posterior = posterior
+        self.start = start
+        self.end = end
+        self.threshold = threshold
+
+    @property
+    def flagged(self):
+        """Boolean mask of the target phonemes scored under the threshold"""
+        return np.nan_to_num(self.gop, nan=0.0) < self.threshold
+
+    @property
+    def score(self):
+        """Overall 0-100 score of the attempt, comparable to the alignment similarity"""
+        scored = ~np.isnan(self.gop)
+        if not scored.any():
+            return 0
+        return int(round(100 * float(np.exp(self.gop[scored]).mean())))
+
+    def locate(self, token):
+        """Time range in seconds of one target phoneme, or None when it got no frames"""
+        if self.start[token] < 0:
+            return None
+        return float(self.start[token] * FRAME_SECONDS), float(self.end[token] * FRAME_SECONDS)
+
+    def to_list(self):
+        return [
+            {
+                "phoneme": phoneme,
+                "start_index": int(self.target.starts[i]),
+                "end_index": int(self.target.ends[i]),
+                "gop": None if np.isnan(self.gop[i]) else round(float(self.gop[i]), 3),
+                "posterior": None if np.isnan(self.posterior[i]) else round(float(self.posterior[i]), 3),
+                "time": None if self.start[i] < 0 else [round(float(self.start[i] * FRAME_SECONDS), 3),
+                                                        round(float(self.end[i] * FRAME_SECONDS), 3)],
+            }
+            for i, phoneme in enumerate(self.target.tokens)
+        ]
+
+
+def score_pronunciation(spans, target, label_map, threshold=GOP_THRESHOLD):
+    """
+    Scores every phoneme of the `target` PhonemeString against the log-posteriors kept
+    in an attempt's PhonemeSpans (see backend.ctc), without running the model again.
+    Returns PronunciationScores, or None when the spans carry no posteriors or the
+    target can't be aligned to the recording.
+    """
+    if spans is None or spans.log_probs is None:
+        return None
+    alignment = forced_align(spans.log_probs, label_map.encode(target), label_map.blank_id)
+    if alignment is None:
+        return None
+    frame_tokens, frame_labels = alignment
+
+    # GOP is aggregated per target token, over the frames of whichever labels spell it
+    aligned = np.flatnonzero(frame_tokens >= 0)
+    frame_owners = frame_tokens[aligned]
+    log_probs = spans.log_probs[aligned]
+    expected = log_probs[np.arange(len(aligned)), frame_labels[aligned]]
+    competitors = log_probs.copy()
+    competitors[:, label_map.blank_id] = -np.inf
+
+    count = len(target)
+    frames = np.bincount(frame_owners, minlength=count).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gop = np.bincount(frame_owners, weights=expected - competitors.max(axis=1), minlength=count) / frames
+        posterior = np.bincount(frame_owners, weights=np.exp(expected), minlength=count) / frames
+
+    # Frames come in target order, so each phoneme's frames are one contiguous run
+    start = np.full(count, -1, dtype=np.int64)
+    end = np.full(count, -1, dtype=np.int64)
+    recording_frames = spans.frames[aligned]
+    owners_seen, first = np.unique(frame_owners, return_index=True)
+    last = np.append(first[1:], len(frame_owners)) - 1
+    start[owners_seen] = recording_frames[first]
+    end[owners_seen] = recording_frames[last] + 1
+
+    return PronunciationScores(target, gop, posterior, start, end, threshold)
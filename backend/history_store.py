@@ -0,0 +1,155 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY,
+    learner TEXT NOT NULL,
+    sentence TEXT NOT NULL,
+    target_phonemes TEXT NOT NULL,
+    user_phonemes TEXT NOT NULL,
+    similarity REAL NOT NULL,
+    timings TEXT,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attempt_errors (
+    attempt_id INTEGER NOT NULL REFERENCES attempts(id),
+    learner TEXT NOT NULL,
+    phoneme TEXT,
+    type TEXT NOT NULL,
+    start_index INTEGER NOT NULL,
+    end_index INTEGER NOT NULL,
+    word TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attempts_learner ON attempts (learner, created_at);
+CREATE INDEX IF NOT EXISTS attempts_sentence ON attempts (learner, sentence, created_at);
+CREATE INDEX IF NOT EXISTS attempts_by_sentence ON attempts (sentence, created_at);
+CREATE INDEX IF NOT EXISTS errors_learner ON attempt_errors (learner, created_at, phoneme);
+CREATE INDEX IF NOT EXISTS errors_phoneme ON attempt_errors (phoneme, created_at);
+CREATE INDEX IF NOT EXISTS errors_attempt ON attempt_errors (attempt_id);
+"""
+
+DAY = 24 * 3600
+
+
+class HistoryStore:
+    """
+    Every analyzed attempt, kept in SQLite for progress tracking.
+
+    `record` only puts the attempt on a queue; a background thread writes queued
+    attempts in batches of up to `batch_size`, one transaction per batch, so storing
+    history never adds latency to an analysis. The learner and timestamp are copied
+    onto every error row so per-learner phoneme statistics are answered from the
+    `(learner, created_at, phoneme)` index alone.
+
+    Progress queries use a connection of their own, so under WAL they read the last
+    committed state while the writer is inserting a batch instead of waiting for it.
+    """
+    def __init__(self, path, batch_size=256, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+        self.lock = threading.Lock()  # guards the writer connection
+
+        # WAL lets this connection read while the writer commits on the other one
+        self.reader = sqlite3.connect(path, check_same_thread=False)
+        self.reader.execute("PRAGMA query_only=ON")
+        self.read_lock = threading.Lock()
+
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def record(self, learner, sentence, target_phonemes, user_phonemes, similarity, corrections, timings=None):
+        """Queues one attempt for writing and returns immediately"""
+        self.queue.put((learner, sentence, target_phonemes, user_phonemes, similarity, list(corrections),
+                        dict(timings or {}), time.time()))
+
+    def flush(self):
+        """Blocks until every queued attempt is on disk"""
+        self.queue.join()
+
+    def _write_loop(self):
+        while True:
+            batch = [self.queue.get()]
+            # Gather whatever else arrives shortly after, up to a full batch
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                print(f"Error writing attempt history: {str(e)}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write(self, batch):
+        with self.lock:
+            errors = []
+            for learner, sentence, target, user, similarity, corrections, timings, created_at in batch:
+                cursor = self.db.execute(
+                    "INSERT INTO attempts (learner, sentence, target_phonemes, user_phonemes, similarity, timings, created_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (learner, sentence, target, user, similarity, json.dumps(timings), created_at),
+                )
+                errors += [
+                    (cursor.lastrowid, learner, c.get('correct'), c['type'], c['start_index'], c['end_index'],
+                     c.get('word'), created_at)
+                    for c in corrections
+                ]
+            self.db.executemany(
+                "INSERT INTO attempt_errors (attempt_id, learner, phoneme, type, start_index, end_index, word, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                errors,
+            )
+            self.db.commit()
+
+    def most_missed_phonemes(self, learner, days=30, limit=10):
+        """Target phonemes the learner substituted or dropped most often in the last `days` days"""
+        with self.read_lock:
+            rows = self.reader.execute(
+                "SELECT phoneme, COUNT(*) AS misses FROM attempt_errors"
+                " WHERE learner = ? AND created_at >= ? AND phoneme IS NOT NULL"
+                " GROUP BY phoneme ORDER BY misses DESC LIMIT ?",
+                (learner, time.time() - days * DAY, limit),
+            ).fetchall()
+        return [{"phoneme": phoneme, "misses": misses} for phoneme, misses in rows]
+
+    def daily_scores(self, learner, days=30):
+        """Attempts and average similarity per day over the last `days` days"""
+        with self.read_lock:
+            rows = self.reader.execute(
+                "SELECT date(created_at, 'unixepoch', 'localtime') AS day, COUNT(*), AVG(similarity) FROM attempts"
+                " WHERE learner = ? AND created_at >= ? GROUP BY day ORDER BY day",
+                (learner, time.time() - days * DAY),
+            ).fetchall()
+        return [{"day": day, "attempts": attempts, "similarity": similarity} for day, attempts, similarity in rows]
+
+    def sentence_history(self, learner, sentence, limit=20):
+        """The learner's latest attempts at one sentence, newest first"""
+        with self.read_lock:
+            rows = self.reader.execute(
+                "SELECT id, user_phonemes, similarity, created_at FROM attempts"
+                " WHERE learner = ? AND sentence = ? ORDER BY created_at DESC LIMIT ?",
+                (learner, sentence, limit),
+            ).fetchall()
+        return [
+            {"id": attempt_id, "user_phonemes": user, "similarity": similarity, "created_at": created_at}
+            for attempt_id, user, similarity, created_at in rows
+        ]
@@ -0,0 +1,268 @@
+"""
+Optional CPU inference backends for the phoneme recognizer.
+
+Every backend wraps the HuggingFace Wav2Vec2ForCTC model into a callable with the
+same signature, `runner(input_values, attention_mask) -> output with .logits`, so
+Listener can switch between them without touching the rest of the pipeline.
+
+Run `python -m backend.inference_backends test.wav error_test.wav` to compare the
+backends against fp32 (phoneme error-rate delta, latency and RSS). For example
+`--backends bf16 --low-memory --max-per-delta 0` fails unless the low-memory bf16
+transcriptions are identical to fp32's.
+"""
+import argparse
+import gc
+import hashlib
+import json
+import os
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+import torch
+
+BACKENDS = ("fp32", "bf16", "int8", "compile", "torchscript", "onnx")
+
+ONNX_OPSET = 17
+
+# Input lengths (seconds) a TorchScript trace is checked on against the eager model
+TRACE_CHECK_SECONDS = (0.7, 2.9, 5.3)
+
+
+class LogitsOnly(torch.nn.Module):
+    """Exposes a plain tensor output so the model can be traced and exported"""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_values, attention_mask):
+        return self.model(input_values, attention_mask=attention_mask).logits
+
+
+class TensorRunner:
+    """Adapts a logits-only module (traced or exported) back to the HuggingFace output shape"""
+    def __init__(self, module):
+        self.module = module
+
+    def __call__(self, input_values, attention_mask=None):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_values, dtype=torch.long)
+        return SimpleNamespace(logits=self.module(input_values, attention_mask))
+
+
+class Bf16Runner:
+    """Feeds a bfloat16 model, handing float32 logits back to the decoder"""
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, input_values, attention_mask=None):
+        output = self.model(input_values.to(torch.bfloat16), attention_mask=attention_mask)
+        return SimpleNamespace(logits=output.logits.float())
+
+
+class OnnxRunner:
+    """Runs an ONNX export of the model with ONNX Runtime"""
+    def __init__(self, path):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, input_values, attention_mask=None):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_values, dtype=torch.long)
+        (logits,) = self.session.run(
+            ["logits"],
+            {"input_values": input_values.numpy(), "attention_mask": attention_mask.numpy().astype("int64")},
+        )
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+def example_inputs(seconds=2, sr=16_000):
+    """Dummy inputs used to trace and export the model"""
+    input_values = torch.zeros(1, int(seconds * sr))
+    return input_values, torch.ones_like(input_values, dtype=torch.long)
+
+
+def export_onnx(model, path):
+    """Exports the model to ONNX with dynamic batch and length axes"""
+    torch.onnx.export(
+        LogitsOnly(model),
+        example_inputs(),
+        path,
+        input_names=["input_values", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={
+            "input_values": {0: "batch", 1: "samples"},
+            "attention_mask": {0: "batch", 1: "samples"},
+            "logits": {0: "batch", 1: "frames"},
+        },
+        opset_version=ONNX_OPSET,
+    )
+    return path
+
+
+def onnx_cache_path(model):
+    """
+    Where the ONNX export of `model` is cached. The file name covers everything the
+    export depends on (the model and its hub revision, the torch version and the
+    opset), so upgrading any of them exports again instead of loading a stale file.
+    """
+    config = model.config
+    key = "|".join([config._name_or_path, str(getattr(config, "_commit_hash", None)), torch.__version__, str(ONNX_OPSET)])
+    name = os.path.basename(config._name_or_path.rstrip("/")) or "wav2vec2"
+    return os.path.join(tempfile.gettempdir(), f"{name}-{hashlib.sha256(key.encode()).hexdigest()[:16]}.onnx")
+
+
+def check_trace(runner, model, seconds=TRACE_CHECK_SECONDS, sr=16_000, tolerance=1e-3):
+    """
+    Compares a traced runner with the eager model on inputs of other lengths than the
+    one it was traced on, including a padded batch, and raises RuntimeError when the
+    trace baked in a shape and the logits differ.
+    """
+    generator = torch.Generator().manual_seed(0)
+    lengths = [int(s * sr) for s in seconds]
+    input_values = torch.randn(len(lengths), max(lengths), generator=generator) * 0.1
+    attention_mask = torch.zeros_like(input_values, dtype=torch.long)
+    for i, length in enumerate(lengths):
+        attention_mask[i, :length] = 1
+    input_values *= attention_mask
+
+    with torch.no_grad():
+        for values, mask in [(input_values[:1, :lengths[0]], attention_mask[:1, :lengths[0]]),
+                             (input_values, attention_mask)]:
+            expected = model(values, attention_mask=mask).logits
+            actual = runner(values, mask).logits
+            if actual.shape != expected.shape or (actual - expected).abs().max() > tolerance:
+                raise RuntimeError(
+                    f"The TorchScript trace doesn't match the model on {values.shape[1] / sr:.1f} s inputs; "
+                    "use another backend"
+                )
+
+
+def prepare_model(model, backend="fp32", onnx_path=None):
+    """
+    Returns `(model, runner)` for the requested backend.
+    `model` stays a Wav2Vec2ForCTC (quantized in place for int8) so its config and
+    helpers remain available; `runner` is what the forward pass should call.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend!r}, expected one of {BACKENDS}")
+
+    model.eval()
+    if backend == "fp32":
+        return model, model
+
+    if backend == "bf16":
+        # Half the memory of fp32 weights; a no-op when the model was loaded in bfloat16 already
+        model.to(torch.bfloat16)
+        return model, Bf16Runner(model)
+
+    if backend == "int8":
+        # Dynamic quantization: int8 weights for every Linear, activations quantized on the fly
+        torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        return model, model
+
+    if backend == "compile":
+        return model, torch.compile(model, dynamic=True)
+
+    if backend == "torchscript":
+        # A trace records one input shape; check_trace verifies it on other lengths
+        with torch.no_grad():
+            traced = torch.jit.trace(LogitsOnly(model), example_inputs(), check_trace=False)
+        runner = TensorRunner(torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval())))
+        check_trace(runner, model)
+        return model, runner
+
+    # ONNX Runtime: export once and reuse the file on later starts
+    if onnx_path is None:
+        onnx_path = onnx_cache_path(model)
+    if not os.path.exists(onnx_path):
+        # Exported next to the cache and renamed, so an interrupted export is never reused
+        partial = f"{onnx_path}.{os.getpid()}.tmp"
+        export_onnx(model, partial)
+        os.replace(partial, onnx_path)
+    return model, OnnxRunner(onnx_path)
+
+
+# --------------------------
+# Validation against fp32
+# --------------------------
+def phoneme_error_rate(reference, hypothesis):
+    """Edit distance between two phoneme strings, relative to the reference length"""
+    import Levenshtein as lev
+
+    return lev.distance(reference, hypothesis) / max(len(reference), 1)
+
+
+def compare_backends(clips, backends=BACKENDS, repeats=3, low_memory=False):
+    """
+    Loads one Listener per backend and transcribes `clips` with it.
+    Returns per-backend latency, RSS, the phoneme error-rate delta against fp32 and
+    whether every clip's phonemes are identical to fp32's (`identical_to_fp32`, with
+    the clips that differ in `differing_clips`).
+    Peak RSS is process-wide, so pass a single backend (plus the fp32 reference)
+    per run when comparing memory. `low_memory` loads the compared backends in
+    Listener's low-memory mode (the fp32 reference is always loaded normally).
+    """
+    from backend.audio import SAMPLE_RATE, load_audio
+    from backend.profiling import rss_mb, peak_rss_mb
+    from pipeline import Listener
+
+    speeches = [load_audio(clip) for clip in clips]
+    audio_seconds = sum(len(speech) for speech in speeches) / SAMPLE_RATE
+    reference = None
+    report = {}
+
+    for backend in ["fp32"] + [b for b in backends if b != "fp32"]:
+        listener = Listener(backend=backend, low_memory=low_memory and backend != "fp32")
+        listener.load()
+
+        latencies = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            phonemes = [listener.speech2phonemes(speech) for speech in speeches]
+            latencies.append(time.perf_counter() - start)
+
+        if reference is None:
+            reference = phonemes
+        per = statistics.mean(phoneme_error_rate(ref, hyp) for ref, hyp in zip(reference, phonemes))
+
+        report[backend] = {
+            "latency_s": statistics.median(latencies),
+            "real_time_factor": statistics.median(latencies) / audio_seconds,
+            "rss_mb": rss_mb(),
+            "peak_rss_mb": peak_rss_mb(),
+            "per_delta_vs_fp32": per,
+            "identical_to_fp32": phonemes == reference,
+            "differing_clips": [clip for clip, ref, hyp in zip(clips, reference, phonemes) if ref != hyp],
+            "phonemes": phonemes,
+        }
+        del listener
+        gc.collect()
+
+    fp32_latency = report["fp32"]["latency_s"]
+    for result in report.values():
+        result["speedup_vs_fp32"] = fp32_latency / result["latency_s"]
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare phoneme recognizer inference backends")
+    parser.add_argument("clips", nargs="+", help="Reference audio clips")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--low-memory", action="store_true", help="Load the compared backends in low-memory mode")
+    parser.add_argument("--max-per-delta", type=float, default=None,
+                        help="Exit with status 1 when a backend's phoneme error-rate delta exceeds this (0 = identical)")
+    args = parser.parse_args()
+
+    report = compare_backends(args.clips, args.backends, args.repeats, args.low_memory)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+    if args.max_per_delta is not None:
+        failed = [backend for backend, result in report.items() if result["per_delta_vs_fp32"] > args.max_per_delta]
+        if failed:
+            raise SystemExit(f"Phonemes differ from fp32 beyond {args.max_per_delta}: {', '.join(failed)}")
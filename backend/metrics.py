@@ -0,0 +1,80 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    Rolling latency histograms for the analysis pipeline.
+    Every span keeps its last `window` durations; `summary()` turns them into
+    percentiles. With `log_path` set, each measurement is also appended to a
+    JSON-lines file.
+    """
+    def __init__(self, window=1000, log_path=None):
+        self.window = window
+        self.samples = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.log = open(log_path, "a", buffering=1, encoding="utf-8") if log_path else None
+
+    def record(self, name, value):
+        """Adds one measurement (seconds for spans, raw values for everything else)"""
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+                self.counts[name] = 0
+            self.samples[name].append(value)
+            self.counts[name] += 1
+            if self.log is not None:
+                self.log.write(json.dumps({"ts": time.time(), "name": name, "value": value}) + "\n")
+
+    @contextmanager
+    def span(self, name, timings=None):
+        """Times a block; the duration is recorded here and, if given, in `timings[name]`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.record(name, elapsed)
+            if timings is not None:
+                timings[name] = elapsed
+
+    def summary(self):
+        """p50/p95/p99, mean and max of every rolling window, plus the all-time count"""
+        with self.lock:
+            snapshot = {name: sorted(values) for name, values in self.samples.items()}
+            counts = dict(self.counts)
+
+        summary = {}
+        for name, values in snapshot.items():
+            if not values:
+                continue
+            summary[name] = {
+                "count": counts[name],
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "mean": sum(values) / len(values),
+                "max": values[-1],
+            }
+        return summary
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.counts.clear()
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    rank = math.ceil(q / 100 * len(sorted_values)) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+
+# Shared by every module; SPEECHTEACHER_METRICS_LOG enables the JSON-lines log
+metrics = Metrics(log_path=os.environ.get("SPEECHTEACHER_METRICS_LOG") or None)
@@ -0,0 +1,213 @@
+import re
+import threading
+
+import numpy as np
+
+# --------------------------
+# Phoneme inventory
+# --------------------------
+# Vowels: (height 0=close..6=open, backness 0=front..2=back, rounded, diphthong)
+VOWELS = {
+    'i': (0, 0, 0, 0), 'y': (0, 0, 1, 0), 'ɨ': (0, 1, 0, 0), 'ᵻ': (0, 1, 0, 0), 'ʉ': (0, 1, 1, 0),
+    'ɯ': (0, 2, 0, 0), 'u': (0, 2, 1, 0),
+    'ɪ': (1, 0, 0, 0), 'ʏ': (1, 0, 1, 0), 'ʊ': (1, 2, 1, 0),
+    'e': (2, 0, 0, 0), 'ø': (2, 0, 1, 0), 'ɘ': (2, 1, 0, 0), 'ɵ': (2, 1, 1, 0), 'ɤ': (2, 2, 0, 0), 'o': (2, 2, 1, 0),
+    'ə': (3, 1, 0, 0), 'ɚ': (3, 1, 0, 0),
+    'ɛ': (4, 0, 0, 0), 'œ': (4, 0, 1, 0), 'ɜ': (4, 1, 0, 0), 'ɝ': (4, 1, 0, 0), 'ɞ': (4, 1, 1, 0),
+    'ʌ': (4, 2, 0, 0), 'ɔ': (4, 2, 1, 0),
+    'æ': (5, 0, 0, 0), 'ɐ': (5, 1, 0, 0),
+    'a': (6, 0, 0, 0), 'ɶ': (6, 0, 1, 0), 'ɑ': (6, 2, 0, 0), 'ɒ': (6, 2, 1, 0),
+    # Diphthongs carry the features of their starting vowel
+    'aɪ': (6, 0, 0, 1), 'aʊ': (6, 0, 0, 1), 'eɪ': (2, 0, 0, 1), 'oʊ': (2, 2, 1, 1), 'əʊ': (3, 1, 0, 1),
+    'ɔɪ': (4, 2, 1, 1), 'ɪə': (1, 0, 0, 1), 'ʊə': (1, 2, 1, 1), 'eə': (2, 0, 0, 1),
+}
+
+# Consonants: (place, manner, voiced)
+PLACES = {'bilabial': 0, 'labiodental': 1, 'dental': 2, 'alveolar': 3, 'postalveolar': 4,
+          'retroflex': 5, 'palatal': 6, 'velar': 7, 'uvular': 8, 'glottal': 9}
+MANNERS = {'plosive': 0, 'nasal': 1, 'trill': 2, 'tap': 3, 'fricative': 4,
+           'affricate': 5, 'approximant': 6, 'lateral': 7}
+CONSONANTS = {
+    'p': ('bilabial', 'plosive', 0), 'b': ('bilabial', 'plosive', 1), 'm': ('bilabial', 'nasal', 1),
+    'ɸ': ('bilabial', 'fricative', 0), 'β': ('bilabial', 'fricative', 1), 'w': ('bilabial', 'approximant', 1),
+    'ʍ': ('bilabial', 'approximant', 0),
+    'f': ('labiodental', 'fricative', 0), 'v': ('labiodental', 'fricative', 1), 'ʋ': ('labiodental', 'approximant', 1),
+    'θ': ('dental', 'fricative', 0), 'ð': ('dental', 'fricative', 1),
+    't': ('alveolar', 'plosive', 0), 'd': ('alveolar', 'plosive', 1), 'n': ('alveolar', 'nasal', 1),
+    'r': ('alveolar', 'trill', 1), 'ɾ': ('alveolar', 'tap', 1), 's': ('alveolar', 'fricative', 0),
+    'z': ('alveolar', 'fricative', 1), 'ɹ': ('alveolar', 'approximant', 1), 'l': ('alveolar', 'lateral', 1),
+    'ɫ': ('alveolar', 'lateral', 1), 'ɬ': ('alveolar', 'fricative', 0), 'ts': ('alveolar', 'affricate', 0),
+    'dz': ('alveolar', 'affricate', 1), 'n̩': ('alveolar', 'nasal', 1), 'l̩': ('alveolar', 'lateral', 1),
+    'ʃ': ('postalveolar', 'fricative', 0), 'ʒ': ('postalveolar', 'fricative', 1),
+    'tʃ': ('postalveolar', 'affricate', 0), 'dʒ': ('postalveolar', 'affricate', 1),
+    'ʈ': ('retroflex', 'plosive', 0), 'ɖ': ('retroflex', 'plosive', 1), 'ɳ': ('retroflex', 'nasal', 1),
+    'ʂ': ('retroflex', 'fricative', 0), 'ʐ': ('retroflex', 'fricative', 1), 'ɻ': ('retroflex', 'approximant', 1),
+    'c': ('palatal', 'plosive', 0), 'ɟ': ('palatal', 'plosive', 1), 'ɲ': ('palatal', 'nasal', 1),
+    'ç': ('palatal', 'fricative', 0), 'ʝ': ('palatal', 'fricative', 1), 'j': ('palatal', 'approximant', 1),
+    'ʎ': ('palatal', 'lateral', 1),
+    'k': ('velar', 'plosive', 0), 'g': ('velar', 'plosive', 1), 'ɡ': ('velar', 'plosive', 1),
+    'ŋ': ('velar', 'nasal', 1), 'x': ('velar', 'fricative', 0), 'ɣ': ('velar', 'fricative', 1),
+    'q': ('uvular', 'plosive', 0), 'ʁ': ('uvular', 'fricative', 1), 'χ': ('uvular', 'fricative', 0),
+    'ʀ': ('uvular', 'trill', 1),
+    'ʔ': ('glottal', 'plosive', 0), 'h': ('glottal', 'fricative', 0), 'ɦ': ('glottal', 'fricative', 1),
+}
+
+# Length marks turn a vowel into a distinct (long) phoneme
+LONG = 'ː'
+# Stress marks and tie bars carry no sound of their own and are skipped by the tokenizer
+IGNORED = 'ˈˌ‿͡|'
+
+PHONEMES = (
+    list(VOWELS)
+    + [vowel + LONG for vowel, features in VOWELS.items() if not features[3]]
+    + list(CONSONANTS)
+)
+PHONEME_IDS = {phoneme: i for i, phoneme in enumerate(PHONEMES)}
+
+# --------------------------
+# Tokenizer
+# --------------------------
+# Clusters eSpeak-NG writes as two phones in English ("kˈæts" is k æ t s, like the
+# recognizer hears it), so the tokenizer never merges them
+SPLIT_CLUSTERS = ('ts', 'dz')
+
+# Longest match first; any other character becomes a token of its own (plus trailing diacritics).
+# Matches never cross whitespace: every space-separated piece of the recognizer's output
+# is one model token and is tokenized on its own.
+_TOKEN_PATTERN = re.compile(
+    "|".join(re.escape(p) for p in sorted(PHONEMES, key=len, reverse=True) if p not in SPLIT_CLUSTERS)
+    + r"|[^\s" + re.escape(IGNORED) + r"][ːˑ̩̥̃̆]*"
+)
+
+# Tokens outside the inventory get IDs on first sight, after the known phonemes
+_extra_ids = {}
+_extra_lock = threading.Lock()
+
+
+def phoneme_id(token):
+    """Stable integer ID of a phoneme token"""
+    if token in PHONEME_IDS:
+        return PHONEME_IDS[token]
+    with _extra_lock:
+        if token not in _extra_ids:
+            _extra_ids[token] = len(PHONEMES) + len(_extra_ids)
+        return _extra_ids[token]
+
+
+def tokenize(ipa):
+    """
+    Splits an IPA string into phoneme tokens with longest-match lookup.
+    Returns `(tokens, starts, ends)` where the offsets index into `ipa`.
+    Whitespace, stress marks and tie bars are skipped.
+    """
+    tokens, starts, ends = [], [], []
+    for match in _TOKEN_PATTERN.finditer(ipa):
+        tokens.append(match.group())
+        starts.append(match.start())
+        ends.append(match.end())
+    return tokens, starts, ends
+
+
+def encode(ipa):
+    """Phoneme ID array of an IPA string"""
+    return np.array([phoneme_id(token) for token in tokenize(ipa)[0]], dtype=np.int32)
+
+
+class PhonemeString:
+    """
+    An IPA string tokenized once, so the alignment, the viseme lookup and the
+    highlighting all share the same tokens: `tokens`, their `ids` and the `starts`
+    and `ends` character offsets into `text`.
+
+    With `words` (the string split into words, as eSpeak-NG returns it), every word
+    is tokenized separately so no phoneme spans a word boundary, and `word_spans`
+    holds the character range of each word.
+    """
+    def __init__(self, text, words=None):
+        if words is not None and ''.join(words) != text:
+            words = None
+        self.text = text
+        self.tokens, starts, ends = [], [], []
+        self.word_spans = [] if words is not None else None
+
+        offset = 0
+        for word in (words if words is not None else [text]):
+            tokens, word_starts, word_ends = tokenize(word)
+            self.tokens += tokens
+            starts += [offset + s for s in word_starts]
+            ends += [offset + e for e in word_ends]
+            if words is not None:
+                self.word_spans.append((offset, offset + len(word)))
+            offset += len(word)
+
+        self.ids = np.array([phoneme_id(token) for token in self.tokens], dtype=np.int64)
+        self.starts = np.array(starts, dtype=np.int64)
+        self.ends = np.array(ends, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def token_range(self, start, end):
+        """Indices `[first, last)` of the tokens inside the character range `[start, end)`"""
+        first = int(np.searchsorted(self.starts, start, side='left'))
+        last = int(np.searchsorted(self.ends, end, side='right'))
+        return first, max(last, first)
+
+    def words_of(self, start, end):
+        """Indices `(first, last)` of the words touched by a character range, or None"""
+        if not self.word_spans:
+            return None
+        word_starts = [s for s, _ in self.word_spans]
+        first = max(int(np.searchsorted(word_starts, start, side='right')) - 1, 0)
+        last = max(int(np.searchsorted(word_starts, max(end - 1, start), side='right')) - 1, first)
+        return first, last
+
+
+# --------------------------
+# Phonetic distance
+# --------------------------
+def _features(token):
+    long = token.endswith(LONG)
+    base = token[:-1] if long else token
+    if base in VOWELS:
+        return 'vowel', VOWELS[base] + (int(long),)
+    if base in CONSONANTS:
+        place, manner, voiced = CONSONANTS[base]
+        return 'consonant', (PLACES[place], MANNERS[manner], voiced)
+    return None, None
+
+
+def substitution_cost(a, b):
+    """
+    Cost of hearing phoneme `b` where `a` was expected, in [0, 1].
+    Close vowels or consonants sharing place/manner are cheap, vowel/consonant swaps cost 1.
+    """
+    if a == b:
+        return 0.0
+    kind_a, fa = _features(a)
+    kind_b, fb = _features(b)
+    if kind_a is None or kind_a != kind_b:
+        return 1.0
+    if kind_a == 'vowel':
+        height, back, rounded, diphthong, long = (abs(x - y) for x, y in zip(fa, fb))
+        distance = (height / 6 + back / 2 + rounded + 0.5 * diphthong + 0.5 * long) / 4
+        return 0.2 + 0.6 * distance
+    place, manner, voiced = abs(fa[0] - fb[0]), fa[1] != fb[1], fa[2] != fb[2]
+    distance = (place / 9 + manner + 0.5 * voiced) / 2.5
+    return 0.3 + 0.6 * distance
+
+
+# Precomputed for the whole inventory so alignments only index into it
+SUBSTITUTION_COSTS = np.array(
+    [[substitution_cost(a, b) for b in PHONEMES] for a in PHONEMES], dtype=np.float64
+)
+
+
+def substitution_matrix(ids):
+    """Square cost matrix between the given phoneme IDs (tokens outside the inventory cost 1)"""
+    ids = np.asarray(ids)
+    known = ids < len(PHONEMES)
+    matrix = np.ones((len(ids), len(ids)), dtype=np.float64)
+    matrix[np.ix_(known, known)] = SUBSTITUTION_COSTS[np.ix_(ids[known], ids[known])]
+    np.fill_diagonal(matrix, 0.0)
+    return matrix
@@ -0,0 +1,89 @@
+import ctypes
+import os
+import sys
+import threading
+
+try:
+    import psutil
+except ImportError:  # psutil is optional, /proc or resource are used instead
+    psutil = None
+
+
+def rss_mb():
+    """Returns the current resident set size of this process in MiB"""
+    if psutil is not None:
+        return psutil.Process(os.getpid()).memory_info().rss / 2**20
+    try:
+        # Second field of statm is the number of resident pages (Linux only)
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of this process in MiB"""
+    if psutil is not None and hasattr(psutil.Process().memory_info(), "peak_wset"):
+        # Windows reports the peak working set directly
+        return psutil.Process(os.getpid()).memory_info().peak_wset / 2**20
+    try:
+        import resource
+    except ImportError:
+        return rss_mb() if psutil is not None else float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+
+class PeakRSS:
+    """
+    Peak resident set size while a block runs. The OS only keeps the all-time peak
+    of the process, so RSS is sampled every `interval` seconds in a background thread.
+
+        with PeakRSS() as memory:
+            listener.analyze(sentence, speech)
+        memory.report()  # {"rss_start_mb": ..., "rss_peak_mb": ..., "rss_end_mb": ...}
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start_mb = self.peak_mb = self.end_mb = None
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = rss_mb()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+        self.thread.start()
+        return self
+
+    def _sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, rss_mb())
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.end_mb = rss_mb()
+        self.peak_mb = max(self.peak_mb, self.end_mb)
+        return False
+
+    def report(self):
+        return {
+            "rss_start_mb": round(self.start_mb, 1),
+            "rss_peak_mb": round(self.peak_mb, 1),
+            "rss_end_mb": round(self.end_mb, 1),
+        }
+
+
+def release_memory():
+    """
+    Hands memory freed by the last request back to the OS. glibc keeps freed heap
+    pages mapped, so without this RSS stays at the high-water mark of the largest clip.
+    """
+    if not sys.platform.startswith("linux"):
+        return
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
@@ -1,33 +1,14 @@
+import hashlib
+import json
 import ollama
 import os
+import threading
+import time
+from collections import OrderedDict
 
-# --------------------------
-# IPA → Viseme mapping
-# --------------------------
-ipa_to_viseme = {
-    '_': 0, ' ': 0,
-    'æ': 1, 'a': 1, 'ə': 1, 'ʌ': 1, 'ɐ': 1,
-    'ɑ': 2, 'ɑː': 2, 'ɒ': 2,
-    'ɔ': 3, 'ɔː': 3,
-    'e': 4, 'eɪ': 4, 'ɛ': 4,
-    'ɜ': 5, 'ɜː': 5, 'ɝ': 5, 'ɚ': 5,
-    'j': 6, 'i': 6, 'iː': 6, 'ɪ': 6, 'ɨ': 6,
-    'w': 7, 'u': 7, 'uː': 7, 'ʊ': 7,
-    'o': 8, 'oʊ': 8, 'əʊ': 8,
-    'aʊ': 9,
-    'ɔɪ': 10,
-    'aɪ': 11,
-    'h': 12, 'ɦ': 12,
-    'r': 13, 'ɹ': 13, 'ɾ': 13,
-    'l': 14, 'ɫ': 14,
-    's': 15, 'z': 15,
-    'ʃ': 16, 'tʃ': 16, 'dʒ': 16, 'ʒ': 16,
-    'θ': 17, 'ð': 17,
-    'f': 18, 'v': 18,
-    'd': 19, 't': 19, 'n': 19,
-    'k': 20, 'g': 20, 'ŋ': 20, 'ɡ': 20,
-    'p': 21, 'b': 21, 'm': 21
-}
+from backend.cache import LRUCache
+from backend.metrics import metrics
+from backend.viseme_identifier import viseme_identifier
 
 # --------------------------
 # Viseme descriptions
@@ -57,32 +38,12 @@ viseme_descriptions = {
     21: "p, b, m — closed lips, full bilabial contact (as in 'pat', 'bat', 'man')."
 }
 
-# --------------------------
-# Viseme identification
-# --------------------------
-def viseme_identifier(diffs):
-    ids = []
-    
-    for diff in diffs:
-        one = ipa_to_viseme.get(diff, 0)
-        
-        ids.append((one, diff))
-        
-    return ids
-
-def viseme_path_identifier(diffs):
-    ids = viseme_identifier(diffs)
-    paths = []
-    for id, phoneme in ids:
-        path = f"visemes/viseme-id-{id}.jpg"
-        paths.append(path)
-    return paths[0]
-
 # --------------------------
 # Prompt construction
 # --------------------------
 def extract_input(sentence, expected_phonemes, user_phonemes, errors):
-    viseme_ids = viseme_identifier(errors)
+    # One entry per mispronounced phoneme, not per error span
+    viseme_ids = [pair for error in errors for pair in viseme_identifier(error)]
     input_string = (
         f"The user pronounced the sentence \"{sentence}\" as: {user_phonemes}.\n"
         f"The correct pronunciation should be: {expected_phonemes}.\n"
@@ -98,26 +59,155 @@ def extract_input(sentence, expected_phonemes, user_phonemes, errors):
 # --------------------------
 # Ollama setup
 # --------------------------
-history = [{"role": "system", "content": "You are a phonetics coach helping learners improve pronunciation. Strictly follow the instructions please."}]
+MODEL = "qwen3:8b"  # replace with your Ollama model name
+SYSTEM_PROMPT = {"role": "system", "content": "You are a phonetics coach helping learners improve pronunciation. Strictly follow the instructions please."}
+
+# Keeps qwen3 and its KV cache loaded between attempts, so the unchanged system prompt
+# (always the first message) is served from the cached prefix instead of reprocessed
+KEEP_ALIVE = os.environ.get("SPEECHTEACHER_OLLAMA_KEEP_ALIVE", "30m")
+
+# Set SPEECHTEACHER_FEEDBACK_HISTORY=0 to answer every attempt independently (e.g. in classrooms)
+USE_HISTORY = os.environ.get("SPEECHTEACHER_FEEDBACK_HISTORY", "1") != "0"
+
+# --------------------------
+# Conversation state
+# --------------------------
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token), enough to enforce a budget"""
+    return len(text) // 4 + 1
+
+
+class Conversation:
+    """
+    The coaching context of one learner session.
+
+    Past turns are stored compactly (the attempt and its mistakes rather than the full
+    extract_input prompt) and only as many as fit in `token_budget` are re-sent.
+    Older turns are dropped from the transcript but their mistakes stay counted, and
+    recurring ones are summarized in a one-line digest sent with the next prompt.
+    """
+    def __init__(self, token_budget=1500):
+        self.token_budget = token_budget
+        self.turns = []  # (user message, assistant message, estimated tokens)
+        self.mistakes = {}  # phoneme -> times missed in this session
+        self.lock = threading.Lock()
+
+    @property
+    def empty(self):
+        return not self.turns and not self.mistakes
+
+    def digest(self):
+        """Short summary of the phonemes missed more than once, or None"""
+        recurring = sorted(((n, p) for p, n in self.mistakes.items() if n > 1), reverse=True)[:8]
+        if not recurring:
+            return None
+        listed = ", ".join(f"{phoneme} ({count}x)" for count, phoneme in recurring)
+        return f"Recurring mistakes in this session so far: {listed}. Mention them if they come up again."
+
+    def messages(self, user_message):
+        """Prompt for the next attempt: system prompt, recent turns, digest, new attempt"""
+        messages = [SYSTEM_PROMPT]
+        for user, assistant, _ in self.turns:
+            messages += [user, assistant]
+        digest = self.digest()
+        if digest:
+            # Kept next to the new attempt so the earlier part of the prompt stays a stable prefix
+            user_message = {"role": "user", "content": digest + "\n\n" + user_message["content"]}
+        return messages + [user_message]
+
+    def add(self, sentence, user_phonemes, errors, assistant_text):
+        """Records a finished turn, then drops the oldest turns that exceed the token budget"""
+        for error in errors:
+            for _, phoneme in viseme_identifier(error):
+                self.mistakes[phoneme] = self.mistakes.get(phoneme, 0) + 1
+
+        summary = f"Attempt at \"{sentence}\": {user_phonemes}. Mistakes: {', '.join(errors) or 'none'}."
+        user = {"role": "user", "content": summary}
+        assistant = {"role": "assistant", "content": assistant_text}
+        self.turns.append((user, assistant, estimate_tokens(summary) + estimate_tokens(assistant_text)))
+
+        total = sum(tokens for _, _, tokens in self.turns)
+        while self.turns and total > self.token_budget:
+            total -= self.turns.pop(0)[2]
+
+
+# One conversation per session; the least recently used ones are forgotten
+MAX_SESSIONS = 256
+sessions = OrderedDict()
+sessions_lock = threading.Lock()
+
+
+def get_conversation(session_id="default"):
+    with sessions_lock:
+        if session_id not in sessions:
+            sessions[session_id] = Conversation()
+            while len(sessions) > MAX_SESSIONS:
+                sessions.popitem(last=False)
+        sessions.move_to_end(session_id)
+        return sessions[session_id]
+
+
+def reset_conversation(session_id="default"):
+    with sessions_lock:
+        sessions.pop(session_id, None)
+
+# --------------------------
+# Response cache
+# --------------------------
+# With temperature 0 the same mistake always gets the same answer, so answers are
+# content-addressed; SPEECHTEACHER_FEEDBACK_CACHE adds a persistent SQLite tier
+feedback_cache = LRUCache(maxsize=512, path=os.environ.get("SPEECHTEACHER_FEEDBACK_CACHE") or None)
+
+def feedback_key(sentence, expected_phonemes, user_phonemes, errors):
+    """Content address of a prompt, built from the same inputs as extract_input"""
+    payload = json.dumps([MODEL, sentence, expected_phonemes, user_phonemes, list(errors)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-def nl_feedback(sentence, expected_phonemes, user_phonemes, errors):
-    global history
+def nl_feedback_stream(sentence, expected_phonemes, user_phonemes, errors, use_history=None, session_id="default"):
+    """Yields the coaching text chunk by chunk while qwen3 is still generating it"""
+    use_history = USE_HISTORY if use_history is None else use_history
     user_input = extract_input(sentence, expected_phonemes, user_phonemes, errors)
-    history.append({"role": "user", "content": user_input})
+    user_message = {"role": "user", "content": user_input}
+    key = feedback_key(sentence, expected_phonemes, user_phonemes, errors)
+    conversation = get_conversation(session_id) if use_history else Conversation()
 
-    response = ollama.chat(
-        model="qwen3:8b",  # replace with your Ollama model name
-        messages=history,
-        think=False,
-        options={"temperature": 0.0}
-    )
-    print(response)
+    # Attempts of one session take turns so each sees a consistent conversation;
+    # different sessions are answered concurrently
+    with conversation.lock:
+        # Earlier turns change the answer, so the cache only applies to a fresh conversation
+        cacheable = conversation.empty
+        assistant_text = feedback_cache.get(key) if cacheable else None
+
+        if assistant_text is not None:
+            yield assistant_text
+        else:
+            chunks = []
+            start = time.perf_counter()
+            stream = ollama.chat(
+                model=MODEL,
+                messages=conversation.messages(user_message),
+                think=False,
+                stream=True,
+                keep_alive=KEEP_ALIVE,
+                options={"temperature": 0.0}
+            )
+            for part in stream:
+                chunk = part['message']['content']
+                if chunk:
+                    if not chunks:
+                        metrics.record("ollama_first_chunk", time.perf_counter() - start)
+                    chunks.append(chunk)
+                    yield chunk
+            metrics.record("ollama", time.perf_counter() - start)
 
-    assistant_text = response['message']['content']
-    history.append({"role": "assistant", "content": assistant_text})
+            assistant_text = "".join(chunks)
+            print(assistant_text)
+            if cacheable:
+                feedback_cache.set(key, assistant_text)
 
-    # Keep history short
-    if len(history) > 10:
-        history = history[:1] + history[-9:]
+        if use_history:
+            conversation.add(sentence, user_phonemes, errors, assistant_text)
 
-    return assistant_text
+def nl_feedback(sentence, expected_phonemes, user_phonemes, errors, use_history=None, session_id="default"):
+    """Blocking variant of nl_feedback_stream that returns the whole answer"""
+    return "".join(nl_feedback_stream(sentence, expected_phonemes, user_phonemes, errors, use_history, session_id))
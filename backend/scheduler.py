@@ -0,0 +1,86 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from backend.audio import SAMPLE_RATE
+from backend.metrics import metrics
+
+
+class BatchScheduler:
+    """
+    Micro-batching in front of the acoustic model.
+
+    Clips submitted from any thread are collected for up to `window_ms` after the
+    first one arrives, or until the padded batch would exceed `max_batch_seconds` of
+    audio (or `max_batch_size` clips), and then transcribed by one `infer` call, a
+    padded forward pass over the whole list. Every caller gets a Future for its own
+    clip. A lone request pays at most the window in extra latency; concurrent
+    requests share a forward pass instead of queueing behind each other's.
+
+    Recorded in backend.metrics: `scheduler_queue_wait` and `scheduler_latency`
+    (seconds, per request), `scheduler_batch_size` and `scheduler_batch_seconds`
+    (clips and seconds of audio per batch).
+    """
+    def __init__(self, infer, window_ms=30, max_batch_seconds=60, max_batch_size=16):
+        self.infer = infer
+        self.window = window_ms / 1000
+        self.max_samples = max_batch_seconds * SAMPLE_RATE
+        self.max_batch_size = max_batch_size
+
+        self.queue = queue.Queue()
+        self.carry = None  # a request that didn't fit the previous batch
+        self.thread = threading.Thread(target=self._loop, name="batch-scheduler", daemon=True)
+        self.thread.start()
+
+    def submit(self, speech):
+        """Queues one 16 kHz waveform; the Future resolves to its entry of `infer`'s result"""
+        future = Future()
+        self.queue.put((speech, future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        """Blocks for the first request, then gathers more until the window closes or the batch is full"""
+        first = self.carry if self.carry is not None else self.queue.get()
+        self.carry = None
+        batch = [first]
+        longest = len(first[0])
+        deadline = first[2] + self.window
+
+        while len(batch) < self.max_batch_size:
+            try:
+                request = self.queue.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            # A batch costs as much as its longest clip times its size
+            if max(longest, len(request[0])) * (len(batch) + 1) > self.max_samples:
+                self.carry = request
+                break
+            batch.append(request)
+            longest = max(longest, len(request[0]))
+        return batch
+
+    def _loop(self):
+        while True:
+            # Requests cancelled while they waited are dropped before inference
+            batch = [request for request in self._collect() if request[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            for _, _, submitted in batch:
+                metrics.record('scheduler_queue_wait', start - submitted)
+            metrics.record('scheduler_batch_size', len(batch))
+            metrics.record('scheduler_batch_seconds', sum(len(speech) for speech, _, _ in batch) / SAMPLE_RATE)
+
+            try:
+                results = self.infer([speech for speech, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            for (_, future, submitted), result in zip(batch, results):
+                metrics.record('scheduler_latency', done - submitted)
+                future.set_result(result)
@@ -0,0 +1,155 @@
+import threading
+
+import numpy as np
+
+from backend.audio import SAMPLE_RATE, trim_silence
+from backend.ctc import FRAME_SAMPLES, PhonemeSpans, best_path
+from backend.metrics import metrics
+
+# Hard cap on one stream's audio, whatever the listener's long-clip policy
+MAX_STREAM_SECONDS = 120
+
+
+class StreamingRecognizer:
+    """
+    Incremental phoneme recognition over a recording that is still growing.
+
+    Audio is transcribed in overlapping windows: every window re-reads `left_context`
+    seconds of already committed audio and keeps its last `right_context` seconds
+    tentative. Frames between the two are committed for good, so when the learner
+    stops only the uncommitted tail has to go through the model.
+
+    Like a recording analyzed in one go (Listener._prepare), the finished stream drops
+    whatever it heard in the leading and trailing silence, and it refuses audio beyond
+    the listener's `max_clip_seconds` when long clips are rejected, or beyond
+    MAX_STREAM_SECONDS otherwise.
+    """
+    def __init__(self, listener, step=1.0, left_context=1.0, right_context=0.5):
+        self.listener = listener
+        self.step = int(step * SAMPLE_RATE)
+        self.left_context = int(left_context * SAMPLE_RATE) // FRAME_SAMPLES * FRAME_SAMPLES
+        self.right_frames = int(right_context * SAMPLE_RATE) // FRAME_SAMPLES
+
+        # Growable sample buffer, doubled when full to keep appends amortized O(1)
+        self.samples = np.zeros(30 * SAMPLE_RATE, dtype=np.float32)
+        self.length = 0
+
+        self.committed_ids = []  # list of frame-label arrays, in order
+        self.committed_confidence = []  # posterior of every committed frame label
+        self.committed_log_probs = []  # every committed frame's log-posteriors, for pronunciation scoring
+        self.committed_frames = 0
+        self.tentative_ids = np.zeros(0, dtype=np.int64)
+        self.tentative_confidence = np.zeros(0, dtype=np.float32)
+        self.tentative_log_probs = None
+        self.partial = ""
+        self.final = None
+        self.speech_frames = None  # `(first, last)` frames inside the voice activity, once finished
+
+        self.max_samples = MAX_STREAM_SECONDS * SAMPLE_RATE
+        if listener.long_clips == "reject":
+            self.max_samples = min(self.max_samples, int(listener.max_clip_seconds * SAMPLE_RATE))
+
+        self.buffer_lock = threading.Lock()
+        self.infer_lock = threading.Lock()
+
+    @property
+    def audio(self):
+        """Everything received so far as one waveform"""
+        with self.buffer_lock:
+            return self.samples[:self.length].copy()
+
+    def push(self, chunk):
+        """
+        Appends 16 kHz samples, float32 in [-1, 1] or raw int16 PCM. Runs a new window
+        once enough fresh audio is buffered and returns the current partial phoneme hypothesis.
+        Raises ValueError when the recording grows past the stream's limit.
+        """
+        with self.buffer_lock:
+            if self.length + len(chunk) > self.max_samples:
+                raise ValueError(f"Recording is too long (the limit is {self.max_samples // SAMPLE_RATE} s)")
+            if self.length + len(chunk) > len(self.samples):
+                grown = np.zeros(max(2 * len(self.samples), self.length + len(chunk)), dtype=np.float32)
+                grown[:self.length] = self.samples[:self.length]
+                self.samples = grown
+            target = self.samples[self.length:self.length + len(chunk)]
+            if np.issubdtype(chunk.dtype, np.integer):
+                # Scaled straight into the buffer, without an intermediate float array
+                np.multiply(chunk, 1 / 32768.0, out=target, casting='unsafe')
+            else:
+                target[:] = chunk
+            self.length += len(chunk)
+            pending = self.length - self.committed_frames * FRAME_SAMPLES
+
+        # Skip inference while a previous window is still running; the next push catches up
+        if pending >= self.step + self.right_frames * FRAME_SAMPLES and self.infer_lock.acquire(blocking=False):
+            try:
+                self._run_window(final=False)
+            finally:
+                self.infer_lock.release()
+        return self.partial
+
+    def finish(self):
+        """
+        Transcribes the uncommitted tail and returns the final phoneme string, without
+        the phonemes heard outside the voice activity
+        """
+        with self.infer_lock:
+            if self.final is None:
+                with metrics.span('stream_finalize'):
+                    self._run_window(final=True)
+                with metrics.span('vad'):
+                    _, start, end = trim_silence(self.audio)
+                metrics.record('vad_trimmed_seconds', (self.length - (end - start)) / SAMPLE_RATE)
+                self.speech_frames = (start // FRAME_SAMPLES, -(-end // FRAME_SAMPLES))
+                first, last = self.speech_frames
+                ids = np.concatenate(self.committed_ids + [self.tentative_ids])[first:last]
+                self.final = self.listener.decode_ids(ids) if len(ids) else ""
+        return self.final
+
+    def _run_window(self, final):
+        with self.buffer_lock:
+            committed_sample = self.committed_frames * FRAME_SAMPLES
+            window_start = max(committed_sample - self.left_context, 0)
+            window = self.samples[window_start:self.length].copy()
+
+        # Too short for a forward pass; the model may not even be loaded yet
+        if len(window) < FRAME_SAMPLES * 2:
+            ids, confidence = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+            log_probs = None
+        else:
+            log_probs = self.listener.frame_posteriors(window)
+            ids, confidence = best_path(log_probs)
+
+        # Drop the left context (already committed) and hold back the right context
+        first = (committed_sample - window_start) // FRAME_SAMPLES
+        last = len(ids) if final else max(len(ids) - self.right_frames, first)
+        if last > first:
+            self.committed_ids.append(ids[first:last])
+            self.committed_confidence.append(confidence[first:last])
+            self.committed_log_probs.append(log_probs[first:last].copy())  # not a view pinning the whole window
+            self.committed_frames += last - first
+        self.tentative_ids = ids[last:]
+        self.tentative_confidence = confidence[last:]
+        self.tentative_log_probs = log_probs[last:] if log_probs is not None else None
+
+        frame_ids = np.concatenate(self.committed_ids + [self.tentative_ids]) if self.committed_ids else self.tentative_ids
+        self.partial = self.listener.decode_ids(frame_ids) if len(frame_ids) else ""
+
+    def spans(self):
+        """
+        Time-aligned phonemes of everything transcribed so far (see backend.ctc.PhonemeSpans),
+        limited to the voice activity once the stream is finished
+        """
+        with self.infer_lock:
+            ids = np.concatenate(self.committed_ids + [self.tentative_ids])
+            confidence = np.concatenate(self.committed_confidence + [self.tentative_confidence])
+            log_probs = self.committed_log_probs + ([self.tentative_log_probs] if self.tentative_log_probs is not None else [])
+            log_probs = np.concatenate(log_probs) if log_probs else None
+            first, last = self.speech_frames or (0, len(ids))
+        if len(ids[first:last]) == 0:
+            return PhonemeSpans.empty(self.listener.vocabulary)
+        if log_probs is not None:
+            log_probs = log_probs[first:last]
+        blank = self.listener.processor.tokenizer.pad_token_id
+        return PhonemeSpans.from_frames(ids[first:last], confidence[first:last], blank, self.listener.vocabulary,
+                                        offset=first, log_probs=log_probs)
@@ -0,0 +1,82 @@
+import base64
+import hashlib
+import io
+import os
+import threading
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, the original JPEGs are served as they are
+    Image = None
+
+from backend.viseme_identifier import viseme_path
+
+VISEME_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "frontend")
+VISEME_COUNT = 22
+
+
+class VisemeAssets:
+    """
+    The viseme images, read from disk once and kept in memory keyed by viseme ID.
+
+    With Pillow available they are downscaled to `max_side` pixels and re-encoded
+    as WebP, which is a fraction of the original JPEG size. The frontend fetches
+    them all at once through `manifest()` and corrections only carry viseme IDs.
+    """
+    def __init__(self, directory=VISEME_DIR, max_side=320, quality=80):
+        self.directory = directory
+        self.max_side = max_side
+        self.quality = quality
+        self.images = {}  # viseme ID -> (mime type, encoded bytes)
+        self._manifest = None
+        self.lock = threading.Lock()
+
+    def _encode(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        if Image is None:
+            return "image/jpeg", data
+        with Image.open(io.BytesIO(data)) as image:
+            image = image.convert("RGB")
+            image.thumbnail((self.max_side, self.max_side))
+            buffer = io.BytesIO()
+            image.save(buffer, format="WEBP", quality=self.quality, method=6)
+        return "image/webp", buffer.getvalue()
+
+    def load(self):
+        """Reads and encodes every viseme image; later calls are no-ops"""
+        with self.lock:
+            if self.images:
+                return self.images
+            images = {}
+            for viseme_id in range(VISEME_COUNT):
+                path = os.path.join(self.directory, viseme_path(viseme_id))
+                if os.path.exists(path):
+                    images[viseme_id] = self._encode(path)
+                else:
+                    print(f"Viseme image not found: {path}")
+            self.images = images
+            return images
+
+    def get(self, viseme_id):
+        """`(mime type, bytes)` of a viseme image, or None"""
+        return self.load().get(viseme_id)
+
+    def manifest(self):
+        """
+        Every image as a data URL keyed by viseme ID, plus a `version` hash the
+        frontend can use to keep its copy across sessions.
+        """
+        images = self.load()
+        with self.lock:
+            if self._manifest is None:
+                digest = hashlib.sha256()
+                urls = {}
+                for viseme_id, (mime, data) in sorted(images.items()):
+                    digest.update(data)
+                    urls[str(viseme_id)] = f"data:{mime};base64," + base64.b64encode(data).decode("ascii")
+                self._manifest = {"version": digest.hexdigest()[:16], "images": urls}
+            return self._manifest
+
+
+viseme_assets = VisemeAssets()
@@ -1,3 +1,6 @@
+import numpy as np
+
+from backend.phonemes import LONG, PHONEMES, PhonemeString
 
 ipa_to_viseme = {
     # Viseme 0: Silence
@@ -10,20 +13,26 @@ ipa_to_viseme = {
     'ə': 1,
     'ʌ': 1,
     'ɐ': 1,
+    'ɘ': 1,
+    'ɤ': 1,
     
     # Viseme 2: aa
     'ɑ': 2,
     'ɑː': 2,
     'ɒ': 2,
+    'ɶ': 2,
     
     # Viseme 3: ao
     'ɔ': 3,
     'ɔː': 3,
+    'ɞ': 3,
+    'œ': 3,
     
     # Viseme 4: ey
     'e': 4,
     'eɪ': 4,
     'ɛ': 4,
+    'eə': 4,
     
     # Viseme 5: er
     'ɜ': 5,
@@ -37,17 +46,28 @@ ipa_to_viseme = {
     'iː': 6,
     'ɪ': 6,
     'ɨ': 6,
+    'ᵻ': 6,
+    'ɯ': 6,
+    'ɪə': 6,
+    'ʝ': 6,
     
     # Viseme 7: w, uw
     'w': 7,
     'u': 7,
     'uː': 7,
     'ʊ': 7,
+    'ʊə': 7,
+    'y': 7,
+    'ʏ': 7,
+    'ʉ': 7,
+    'ʍ': 7,
     
     # Viseme 8: ow
     'o': 8,
     'oʊ': 8,
     'əʊ': 8,
+    'ø': 8,
+    'ɵ': 8,
     
     # Viseme 9: aw
     'aʊ': 9,
@@ -61,15 +81,21 @@ ipa_to_viseme = {
     # Viseme 12: h
     'h': 12,
     'ɦ': 12,
+    'ʔ': 12,
+    'ç': 12,
     
     # Viseme 13: r
     'r': 13,
     'ɹ': 13,
     'ɾ': 13,
+    'ɻ': 13,
     
     # Viseme 14: l
     'l': 14,
     'ɫ': 14,
+    'l̩': 14,
+    'ɬ': 14,
+    'ʎ': 14,
     
     # Viseme 15: s, z
     's': 15,
@@ -80,6 +106,8 @@ ipa_to_viseme = {
     'tʃ': 16,
     'dʒ': 16,
     'ʒ': 16,
+    'ʂ': 16,
+    'ʐ': 16,
     
     # Viseme 17: th, dh
     'θ': 17,
@@ -88,58 +116,72 @@ ipa_to_viseme = {
     # Viseme 18: f, v
     'f': 18,
     'v': 18,
+    'ʋ': 18,
     
     # Viseme 19: d, t, n
     'd': 19,
     't': 19,
     'n': 19,
+    'n̩': 19,
+    'ts': 19,
+    'dz': 19,
+    'ʈ': 19,
+    'ɖ': 19,
+    'ɳ': 19,
+    'ɲ': 19,
     
     # Viseme 20: k, g, ng
     'k': 20,
     'g': 20,
     'ŋ': 20,
     'ɡ': 20,
+    'c': 20,
+    'ɟ': 20,
+    'x': 20,
+    'ɣ': 20,
+    'q': 20,
+    'χ': 20,
+    'ʁ': 20,
+    'ʀ': 20,
     
     # Viseme 21: p, b, m
     'p': 21,
     'b': 21,
     'm': 21,
+    'ɸ': 21,
+    'β': 21,
 }
 
-diffs = "gtʃb"
+# A long vowel looks like its short counterpart
+for phoneme in PHONEMES:
+    if phoneme.endswith(LONG):
+        ipa_to_viseme.setdefault(phoneme, ipa_to_viseme[phoneme[:-len(LONG)]])
+
+# Viseme of every phoneme ID, so a whole utterance maps to visemes with one indexing
+# operation; tokens outside the inventory fall back to viseme 0 (silence)
+VISEME_TABLE = np.array([ipa_to_viseme.get(phoneme, 0) for phoneme in PHONEMES], dtype=np.int64)
+
+
+def viseme_ids(phonemes):
+    """Viseme ID array of an IPA string or of an already tokenized PhonemeString"""
+    if not isinstance(phonemes, PhonemeString):
+        phonemes = PhonemeString(phonemes)
+    ids = phonemes.ids
+    known = ids < len(VISEME_TABLE)
+    return np.where(known, VISEME_TABLE[np.where(known, ids, 0)], 0)
+
 
 def viseme_identifier(diffs):
-    ids = []
-    i = 0
+    """`(viseme_id, phoneme)` for every phoneme of `diffs`"""
+    phonemes = diffs if isinstance(diffs, PhonemeString) else PhonemeString(diffs)
+    return list(zip(viseme_ids(phonemes).tolist(), phonemes.tokens))
 
 
-    while i < len(diffs):
-        one = ipa_to_viseme.get(diffs[i], None)
-        two = ipa_to_viseme.get(diffs[i:i+2], None) if i + 1 < len(diffs) else None
-        image_id = 0
-        if two is not None:
-            image_id = two
-            i += 1
-            ids.append((image_id, two))
-        elif one is not None:
-            image_id = one
-            ids.append((image_id, one))
+def viseme_path(viseme_id):
+    """Image of a viseme, relative to the frontend folder"""
+    return f"visemes/viseme-id-{viseme_id}.jpg"
 
-        i += 1
-        
-    return ids
 
 def viseme_path_identifier(diffs):
-    ids = viseme_identifier(diffs)
-    paths = []
-    for id, phoneme in ids:
-        path = f"./viseme_feedback/visemes/viseme-id-{id}.jpg"
-        paths.append(path)
-    return paths
-def viseme_path_identifier(diffs):
-    ids = viseme_identifier(diffs)
-    paths = []
-    for id, phoneme in ids:
-        path = f"./viseme_feedback/visemes/viseme-id-{id}.jpg"
-        paths.append(path)
-    return paths
\ No newline at end of file
+    """Image paths of the visemes of every phoneme in `diffs`, in order"""
+    return [viseme_path(viseme_id) for viseme_id, _ in viseme_identifier(diffs)]
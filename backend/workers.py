@@ -0,0 +1,22 @@
+"""
+Worker-process helpers shared by batch_score.py and server.py: every worker builds
+and loads its own Listener once, in the pool's initializer.
+"""
+import os
+
+# Set in every worker process by init_worker
+worker_listener = None
+
+
+def init_worker(options):
+    """Loads one model per worker process; `options` are pipeline.Listener keyword arguments"""
+    global worker_listener
+    from pipeline import Listener
+
+    worker_listener = Listener(**options)
+    worker_listener.load()
+
+
+def worker_ready():
+    """Returns once the worker's initializer has run (the model is loaded)"""
+    return os.getpid()
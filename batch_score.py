@@ -0,0 +1,169 @@
+"""
+Offline scoring of archived recordings against their prompt sentences.
+
+    python batch_score.py manifest.csv --output scores.jsonl --workers 4
+
+The manifest is a CSV (with `audio_path` and `sentence` columns) or a JSONL file
+with the same keys. Results are appended to the output as JSON lines as soon as
+they are ready; rerunning with the same output skips every row already scored,
+so a crashed run picks up where it left off.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from backend import workers
+
+
+def read_manifest(path):
+    """Yields `(audio_path, sentence)` rows from a CSV or JSONL manifest"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for row in rows:
+            yield row["audio_path"], row["sentence"]
+
+
+def row_key(audio_path, sentence):
+    return f"{audio_path}\t{sentence}"
+
+
+def completed_rows(output_path):
+    """Keys of the rows already present in a previous (possibly truncated) output file"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by a crash gets scored again
+            if "error" in result:
+                continue  # failed rows are retried
+            done.add(row_key(result["audio_path"], result["sentence"]))
+    return done
+
+
+def spans(target_phonemes, user_phonemes, alignment, indices):
+    return [
+        {
+            "target": [ref_start, ref_end],
+            "user": [user_start, user_end],
+            "target_phonemes": target_phonemes[ref_start:ref_end],
+            "user_phonemes": user_phonemes[user_start:user_end],
+            "words": list(alignment.words_of(ref_start, ref_end) or ()),
+        }
+        for (ref_start, ref_end), (user_start, user_end) in indices
+    ]
+
+
+def score_rows(rows, feedback):
+    """Scores a chunk of rows inside a worker, with one batched forward pass for the chunk"""
+    from backend.audio import load_audio
+    from backend.quen3_model import nl_feedback
+
+    listener = workers.worker_listener
+    listener.prephonemize([sentence for _, sentence in rows])
+
+    # Load every clip first so one unreadable file doesn't fail the whole batch
+    results, loaded = [], []
+    for audio_path, sentence in rows:
+        try:
+            loaded.append((audio_path, sentence, load_audio(audio_path)))
+        except Exception as e:
+            results.append({"audio_path": audio_path, "sentence": sentence, "error": str(e)})
+
+    user_phonemes_list = listener.speech2phonemes_batch([speech for _, _, speech in loaded])
+    for (audio_path, sentence, _), user_phonemes in zip(loaded, user_phonemes_list):
+        try:
+            target_words = listener.text2words(sentence)
+            target_phonemes = "".join(target_words)
+            alignment = listener.align(user_phonemes, target_phonemes, target_words)
+            result = {
+                "audio_path": audio_path,
+                "sentence": sentence,
+                "similarity": alignment.similarity,
+                "target_phonemes": target_phonemes,
+                "target_words": target_words,
+                "user_phonemes": user_phonemes,
+                "substitutions": spans(target_phonemes, user_phonemes, alignment, alignment.substitutions),
+                "deletions": spans(target_phonemes, user_phonemes, alignment, alignment.deletions),
+                "insertions": spans(target_phonemes, user_phonemes, alignment, alignment.insertions),
+            }
+            if feedback:
+                errors = [s["target_phonemes"] for s in result["deletions"] + result["substitutions"]]
+                result["feedback"] = nl_feedback(sentence, target_phonemes, user_phonemes, errors, use_history=False)
+            results.append(result)
+        except Exception as e:
+            results.append({"audio_path": audio_path, "sentence": sentence, "error": str(e)})
+    return results
+
+
+def chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score recordings listed in a CSV/JSONL manifest")
+    parser.add_argument("manifest", help="CSV or JSONL with audio_path and sentence")
+    parser.add_argument("--output", required=True, help="JSONL file to append results to (also used to resume)")
+    parser.add_argument("--workers", type=int, default=max((os.cpu_count() or 2) // 2, 1),
+                        help="Worker processes, each holding its own model")
+    parser.add_argument("--chunk-size", type=int, default=16, help="Rows scored per worker task (one batched forward pass)")
+    parser.add_argument("--backend", default="fp32", help="Inference backend, see backend/inference_backends.py")
+    parser.add_argument("--no-feedback", action="store_true", help="Skip the LLM feedback")
+    args = parser.parse_args()
+
+    done = completed_rows(args.output)
+    pending = (row for row in read_manifest(args.manifest) if row_key(*row) not in done)
+    if done:
+        print(f"Resuming: {len(done)} rows already scored", file=sys.stderr)
+
+    scored = 0
+    start = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    with open(args.output, "a", encoding="utf-8") as out, ProcessPoolExecutor(
+        max_workers=args.workers, mp_context=context, initializer=workers.init_worker,
+        initargs=({"backend": args.backend, "cache_dir": None},)
+    ) as pool:
+        # Keep a bounded number of chunks in flight so huge manifests are streamed, not loaded
+        in_flight = set()
+        for chunk in chunks(pending, args.chunk_size):
+            in_flight.add(pool.submit(score_rows, chunk, not args.no_feedback))
+            if len(in_flight) >= args.workers * 2:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                scored += write_results(out, finished)
+                print(f"{scored} rows scored ({scored / (time.perf_counter() - start):.1f}/s)", file=sys.stderr)
+        scored += write_results(out, in_flight)
+
+    print(f"Done: {scored} rows scored in {time.perf_counter() - start:.0f} s", file=sys.stderr)
+
+
+def write_results(out, futures):
+    count = 0
+    for future in futures:
+        for result in future.result():
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            count += 1
+    # Flushed per chunk so a crash loses at most the chunks still in flight
+    out.flush()
+    return count
+
+
+if __name__ == "__main__":
+    main()
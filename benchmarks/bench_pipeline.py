@@ -0,0 +1,183 @@
+"""
+Benchmark harness for the Listener pipeline.
+
+    python -m benchmarks.bench_pipeline --output benchmarks/baseline.json
+    python -m benchmarks.bench_pipeline --compare benchmarks/baseline.json
+
+Runs speech2phonemes, text2phonemes, get_misalignments and the full __call__
+over a reproducible corpus (the bundled clips plus synthetic clips of varying
+length) and writes throughput, latency percentiles and peak memory to JSON.
+The LLM is replaced by a local stub ollama server unless --real-ollama is given.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.stub_ollama import start_stub_ollama
+
+REFERENCE_SENTENCE = "Anthony likes apple pie"
+BUNDLED_CLIPS = ["test.wav", "error_test.wav"]
+SYNTHETIC_SECONDS = [5, 10, 20, 30]
+
+
+def build_corpus(sr):
+    """Returns `[(name, waveform, sentence)]`; synthetic clips are derived deterministically"""
+    from backend.audio import load_audio
+
+    corpus = [(path, load_audio(path, sr=sr), REFERENCE_SENTENCE) for path in BUNDLED_CLIPS]
+    base = corpus[0][1]
+    rng = np.random.default_rng(0)
+
+    # Longer utterances: the reference sentence repeated with short pauses in between
+    gap = np.zeros(int(0.3 * sr), dtype=np.float32)
+    for seconds in SYNTHETIC_SECONDS:
+        repeats = max(int(np.ceil(seconds * sr / (len(base) + len(gap)))), 1)
+        clip = np.concatenate([np.concatenate([base, gap])] * repeats)[: seconds * sr]
+        # A little noise so repeated segments aren't bit-identical
+        clip = clip + rng.normal(0, 1e-3, len(clip)).astype(np.float32)
+        corpus.append((f"synthetic_{seconds}s", clip.astype(np.float32), " ".join([REFERENCE_SENTENCE] * repeats)))
+
+    # Degenerate inputs: pure silence and pure noise
+    corpus.append(("silence_3s", np.zeros(3 * sr, dtype=np.float32), REFERENCE_SENTENCE))
+    corpus.append(("noise_3s", rng.normal(0, 0.05, 3 * sr).astype(np.float32), REFERENCE_SENTENCE))
+    return corpus
+
+
+def summarize(latencies, items, audio_seconds=None):
+    """Latency percentiles in ms and throughput for one benchmarked operation"""
+    values = np.array(latencies) * 1000
+    total = float(np.sum(latencies))
+    result = {
+        "runs": len(latencies),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean()),
+        "items_per_s": items / total if total else None,
+    }
+    if audio_seconds is not None:
+        result["audio_seconds_per_s"] = audio_seconds / total if total else None
+    return result
+
+
+def timed_runs(fn, args_list, repeats):
+    """Calls `fn(*args)` for every args tuple, `repeats` times, returning the per-call latencies"""
+    latencies = []
+    for _ in range(repeats):
+        for args in args_list:
+            start = time.perf_counter()
+            fn(*args)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run(repeats=3, backend="fp32"):
+    from backend import quen3_model
+    from backend.audio import SAMPLE_RATE
+    from backend.cache import LRUCache
+    from backend.metrics import metrics
+    from backend.profiling import peak_rss_mb, rss_mb
+    from pipeline import Listener
+
+    listener = Listener(backend=backend, cache_dir=None)
+    start = time.perf_counter()
+    listener.load()
+    load_seconds = time.perf_counter() - start
+
+    corpus = build_corpus(SAMPLE_RATE)
+    speeches = [(speech,) for _, speech, _ in corpus]
+    sentences = [(sentence,) for _, _, sentence in corpus]
+    audio_seconds = sum(len(speech) for _, speech, _ in corpus) / SAMPLE_RATE
+    results = {}
+
+    # Acoustic model, one clip at a time and as a single batched call
+    results["speech2phonemes"] = summarize(
+        timed_runs(listener.speech2phonemes, speeches, repeats), len(corpus) * repeats, audio_seconds * repeats
+    )
+    results["speech2phonemes_batch"] = summarize(
+        timed_runs(listener.speech2phonemes_batch, [([speech for (speech,) in speeches],)], repeats),
+        len(corpus) * repeats, audio_seconds * repeats,
+    )
+
+    # eSpeak-NG with the pronunciation cache disabled, then with it warm
+    listener.pronunciations = LRUCache(maxsize=0)
+    results["text2phonemes_uncached"] = summarize(timed_runs(listener.text2phonemes, sentences, repeats), len(corpus) * repeats)
+    listener.pronunciations = LRUCache(maxsize=1024)
+    listener.prephonemize([sentence for (sentence,) in sentences])
+    results["text2phonemes_cached"] = summarize(timed_runs(listener.text2phonemes, sentences, repeats), len(corpus) * repeats)
+
+    # Alignment on the phoneme pairs the pipeline actually produces
+    pairs = [(listener.speech2phonemes(speech), listener.text2phonemes(sentence))
+             for (speech,), (sentence,) in zip(speeches, sentences)]
+    results["get_misalignments"] = summarize(timed_runs(listener.get_misalignments, pairs, repeats), len(pairs) * repeats)
+
+    # Whole pipeline, LLM included but without the feedback cache short-circuiting it
+    quen3_model.feedback_cache = LRUCache(maxsize=0)
+    metrics.reset()
+    results["pipeline"] = summarize(
+        timed_runs(listener, [(sentence, speech) for (speech,), (sentence,) in zip(speeches, sentences)], repeats),
+        len(corpus) * repeats, audio_seconds * repeats,
+    )
+    results["pipeline"]["stages"] = {name: stats["p50"] * 1000 for name, stats in metrics.summary().items()}
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "backend": backend,
+        },
+        "corpus": [{"name": name, "seconds": len(speech) / SAMPLE_RATE} for name, speech, _ in corpus],
+        "load_seconds": load_seconds,
+        "rss_mb": rss_mb(),
+        "peak_rss_mb": peak_rss_mb(),
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Returns a list of operations whose p50 latency regressed by more than `tolerance`"""
+    regressions = []
+    for name, result in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous and result["p50_ms"] > previous["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p50 {previous['p50_ms']:.1f} ms -> {result['p50_ms']:.1f} ms")
+    if baseline.get("peak_rss_mb") and report["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f"peak RSS: {baseline['peak_rss_mb']:.0f} MB -> {report['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Listener pipeline")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--backend", default="fp32")
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--compare", help="Baseline JSON report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown before failing")
+    parser.add_argument("--llm-delay", type=float, default=0.0, help="Seconds per streamed word in the stub LLM")
+    parser.add_argument("--real-ollama", action="store_true", help="Use the configured ollama server instead of the stub")
+    args = parser.parse_args()
+
+    if not args.real_ollama:
+        # Must happen before the ollama client is imported (through pipeline)
+        server, host = start_stub_ollama(args.llm_delay)
+        os.environ["OLLAMA_HOST"] = host
+
+    report = run(args.repeats, args.backend)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,201 @@
+"""
+Load test of the headless server (server.py) with simulated learners.
+
+    python -m benchmarks.load_test --learners 40 --attempts 3 --workers 2
+    python -m benchmarks.load_test --url http://lab-server:8000 --learners 60
+
+Every learner is a thread with its own session: it uploads a recording in PCM
+chunks (paced like a live microphone with --realtime), submits it, retries when the
+server answers 503 and waits for the streamed feedback through the event long poll.
+Without --url, a server is started locally with a stub LLM (benchmarks.stub_ollama).
+Reports latency percentiles of the submission and of the complete feedback,
+throughput and how often learners were turned away.
+"""
+import argparse
+import base64
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import numpy as np
+
+from benchmarks.bench_pipeline import REFERENCE_SENTENCE, summarize
+from benchmarks.stub_ollama import start_stub_ollama
+
+CHUNK_SECONDS = 0.5
+
+
+class Learner:
+    """One simulated browser talking to the server like frontend/http_bridge.js"""
+    def __init__(self, url, max_retries=30):
+        self.url = url.rstrip("/")
+        self.session_id = uuid.uuid4().hex
+        self.max_retries = max_retries
+        self.rejected = 0
+        self.cursor = 0  # last event seen by the long poll
+
+    def _request(self, path, body=None, timeout=120):
+        request = urllib.request.Request(
+            self.url + path,
+            data=None if body is None else json.dumps(body).encode(),
+            headers={"Content-Type": "application/json", "X-Session-Id": self.session_id},
+        )
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+
+    def call(self, method, *args):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._request(f"/api/{method}", list(args))
+            except urllib.error.HTTPError as e:
+                if e.code != 503 or attempt == self.max_retries:
+                    raise
+                self.rejected += 1
+                time.sleep(float(e.headers.get("Retry-After") or 1) * (1 + np.random.random()))
+
+    def wait_feedback(self, feedback_id, since=0, timeout=120):
+        """Long-polls events until the feedback is complete; returns the event cursor"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            result = self._request(f"/api/events?since={since}")
+            since = result["next"]
+            if any(name == "onFeedbackDone" and args[0] == feedback_id for name, args in result["events"]):
+                return since
+        raise TimeoutError("No feedback received")
+
+    def attempt(self, pcm, sentence, realtime=False):
+        """Uploads and submits one recording; returns `(submit seconds, feedback seconds)`"""
+        stream = self.call("start_stream")["request_id"]
+        chunk_bytes = int(CHUNK_SECONDS * 16000) * 2
+        for start in range(0, len(pcm), chunk_bytes):
+            self.call("push_stream_chunk", stream, base64.b64encode(pcm[start:start + chunk_bytes]).decode("ascii"))
+            if realtime:
+                time.sleep(CHUNK_SECONDS)
+
+        start = time.perf_counter()
+        result = self.call("analyze_audio", stream, sentence)
+        submitted = time.perf_counter() - start
+        if not result.get("success"):
+            raise RuntimeError(result.get("error"))
+        self.cursor = self.wait_feedback(result["feedback_id"], self.cursor)
+        return submitted, time.perf_counter() - start
+
+
+def load_pcm(path):
+    """A recording as 16 kHz 16-bit PCM bytes"""
+    from backend.audio import load_audio
+
+    speech = load_audio(path)
+    return (np.clip(speech, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def wait_ready(url, timeout=600):
+    learner = Learner(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            status = learner.call("get_status")
+            if status["ready"]:
+                return
+            if status["status"] == "error":
+                raise RuntimeError(f"Server failed to start: {status['error']}")
+        except urllib.error.URLError:
+            pass
+        time.sleep(1)
+    raise TimeoutError("Server didn't become ready")
+
+
+def start_server(port, workers, queue, llm_delay, threads=None, batch_window_ms=None):
+    """Runs server.py locally against a stub LLM; returns the process"""
+    _, host = start_stub_ollama(llm_delay)
+    command = [sys.executable, "server.py", "--port", str(port), "--workers", str(workers)]
+    if queue is not None:
+        command += ["--queue", str(queue)]
+    if threads is not None:
+        command += ["--threads", str(threads)]
+    if batch_window_ms is not None:
+        command += ["--batch-window-ms", str(batch_window_ms)]
+    return subprocess.Popen(command, env={**os.environ, "OLLAMA_HOST": host})
+
+
+def run(url, learners, attempts, pcm, sentence, realtime=False):
+    submit_latencies, feedback_latencies, errors = [], [], []
+    simulated = [Learner(url) for _ in range(learners)]
+    lock = threading.Lock()
+
+    def learn(learner):
+        for _ in range(attempts):
+            try:
+                submitted, completed = learner.attempt(pcm, sentence, realtime)
+                with lock:
+                    submit_latencies.append(submitted)
+                    feedback_latencies.append(completed)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=learn, args=(learner,)) for learner in simulated]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    completed = len(submit_latencies)
+    return {
+        "learners": learners,
+        "attempts": learners * attempts,
+        "completed": completed,
+        "errors": len(errors),
+        "first_errors": errors[:5],
+        "rejected_503": sum(learner.rejected for learner in simulated),
+        "seconds": elapsed,
+        "attempts_per_s": completed / elapsed if elapsed else None,
+        "submit": summarize(submit_latencies, completed) if completed else None,
+        "feedback": summarize(feedback_latencies, completed) if completed else None,
+        "server_metrics": Learner(url).call("get_metrics"),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the headless server with simulated learners")
+    parser.add_argument("--url", help="Server to test; by default one is started locally")
+    parser.add_argument("--learners", type=int, default=40)
+    parser.add_argument("--attempts", type=int, default=3, help="Attempts per learner")
+    parser.add_argument("--audio", default="test.wav", help="Recording every learner submits")
+    parser.add_argument("--sentence", default=REFERENCE_SENTENCE)
+    parser.add_argument("--realtime", action="store_true", help="Upload chunks at the pace of a live microphone")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the local server")
+    parser.add_argument("--workers", type=int, default=2, help="Workers of the local server")
+    parser.add_argument("--queue", type=int, default=None, help="Queue size of the local server")
+    parser.add_argument("--threads", type=int, default=None, help="Threads per worker of the local server")
+    parser.add_argument("--batch-window-ms", type=float, default=None, help="Micro-batching window of the local server")
+    parser.add_argument("--llm-delay", type=float, default=0.0, help="Seconds per streamed word in the stub LLM")
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        server = start_server(args.port, args.workers, args.queue, args.llm_delay, args.threads, args.batch_window_ms)
+        url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_ready(url)
+        report = run(url, args.learners, args.attempts, load_pcm(args.audio), args.sentence, args.realtime)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
@@ -0,0 +1,64 @@
+"""
+Minimal stand-in for the ollama HTTP API, so the pipeline can be benchmarked
+without a GPU or a downloaded LLM. Only /api/chat is implemented, streaming or not.
+"""
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_REPLY = (
+    "You replaced one vowel sound. Open your jaw a little more and glide to the second vowel. "
+    "Try: 'I like my kite.' 'Time to fly.'"
+)
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    # Seconds to wait before each streamed word, to mimic generation speed
+    token_delay = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _message(self, content, done):
+        return {
+            "model": self.request_body.get("model", "stub"),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": content},
+            "done": done,
+            **({"done_reason": "stop"} if done else {}),
+        }
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.request_body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path != "/api/chat":
+            self.send_error(404)
+            return
+
+        if self.request_body.get("stream", True):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            for word in STUB_REPLY.split(" "):
+                time.sleep(self.token_delay)
+                self.wfile.write((json.dumps(self._message(word + " ", False)) + "\n").encode())
+                self.wfile.flush()
+            self.wfile.write((json.dumps(self._message("", True)) + "\n").encode())
+        else:
+            time.sleep(self.token_delay * len(STUB_REPLY.split(" ")))
+            body = json.dumps(self._message(STUB_REPLY, True)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+def start_stub_ollama(token_delay=0.0):
+    """Starts the stub on a free local port and returns `(server, host)` for OLLAMA_HOST"""
+    handler = type("Handler", (StubOllamaHandler,), {"token_delay": token_delay})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
@@ -0,0 +1,65 @@
+// Stands in for the pywebview bridge when the frontend is served by server.py.
+// Every window.pywebview.api.<method>(...) call is POSTed to /api/<method>, and the
+// calls the desktop app would push into the window (onFeedbackChunk, onFeedbackDone)
+// are long-polled from /api/events. Only loaded by server.py, never in the desktop app.
+(function () {
+    const SESSION_KEY = 'speechteacher-session';
+    const MAX_BUSY_RETRIES = 10;
+
+    // One session per browser; it also names the learner's history on the server
+    let sessionId = localStorage.getItem(SESSION_KEY);
+    if (!sessionId) {
+        const bytes = crypto.getRandomValues(new Uint8Array(16));
+        sessionId = Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+        localStorage.setItem(SESSION_KEY, sessionId);
+    }
+    const headers = { 'Content-Type': 'application/json', 'X-Session-Id': sessionId };
+
+    const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+    async function call(method, args) {
+        for (let attempt = 0; ; attempt++) {
+            const response = await fetch(`/api/${method}`, {
+                method: 'POST',
+                headers,
+                body: JSON.stringify(args),
+            });
+            // The server turns attempts away while its queue is full; wait as told and retry
+            if (response.status === 503 && attempt < MAX_BUSY_RETRIES) {
+                const retryAfter = Number(response.headers.get('Retry-After')) || 1;
+                await sleep(retryAfter * 1000 * (1 + Math.random()));
+                continue;
+            }
+            return response.json();
+        }
+    }
+
+    async function pollEvents() {
+        let since = 0;
+        for (;;) {
+            try {
+                const response = await fetch(`/api/events?since=${since}`, { headers });
+                if (!response.ok) throw new Error(`Event poll failed: ${response.status}`);
+                const result = await response.json();
+                for (const [name, args] of result.events) {
+                    if (typeof window[name] === 'function') window[name](...args);
+                }
+                since = result.next;
+            } catch (error) {
+                console.warn(error);
+                await sleep(1000);
+            }
+        }
+    }
+
+    const api = new Proxy({}, {
+        // `then` is looked up when the object is awaited; it must not become an API call
+        get: (_, method) => method === 'then' ? undefined : (...args) => call(method, args),
+    });
+    window.pywebview = { api };
+
+    window.addEventListener('DOMContentLoaded', () => {
+        window.dispatchEvent(new Event('pywebviewready'));
+        pollEvents();
+    });
+})();
@@ -6,6 +6,30 @@ let audioContext;
 let analyser;
 let animationFrameId;
 
+// Coaching text streamed from the backend for the attempt currently on screen
+let currentFeedbackId = null;
+let feedbackText = '';
+
+// Live streaming of 16 kHz PCM to the backend while the learner speaks
+const STREAM_SAMPLE_RATE = 16000;
+const STREAM_CHUNK_SAMPLES = 4000; // ~250 ms per bridge call
+let pcmProcessor = null;
+let resampler = null;
+let pendingPcm = [];
+let pendingSamples = 0;
+let liveStreamId = null;
+let liveStreamQueue = Promise.resolve();
+// Every PCM chunk of the current recording, to upload it again if no live stream is open
+let recordedPcm = [];
+const UPLOAD_CHUNK_SAMPLES = 5 * STREAM_SAMPLE_RATE;
+
+// Set to true to keep a copy of every attempt in the recordings directory
+const ARCHIVE_RECORDINGS = false;
+
+// Viseme images as data URLs keyed by viseme ID, fetched once and kept across sessions
+const VISEME_CACHE_KEY = 'visemeManifest';
+let visemeImages = {};
+
 // DOM Elements
 const sentenceInput = document.getElementById('sentenceInput');
 const updateBtn = document.getElementById('updateBtn');
@@ -24,12 +48,16 @@ const recordingControls = document.getElementById('recordingControls');
 const newRecordingBtn = document.getElementById('newRecordingBtn');
 const waveformContainer = document.getElementById('waveformContainer');
 const waveform = document.getElementById('waveform');
+const modelStatus = document.getElementById('modelStatus');
+const partialPhonemes = document.getElementById('partialPhonemes');
 
 // Initialize
 document.addEventListener('DOMContentLoaded', () => {
     console.log('Speech Teacher App Initialized');
     checkMicrophonePermission();
     setupEventListeners();
+    pollModelStatus();
+    loadVisemeManifest();
 });
 
 // Event Listeners
@@ -46,6 +74,75 @@ function setupEventListeners() {
     newRecordingBtn.addEventListener('click', startNewRecording);
 }
 
+// Load the viseme images once; corrections only carry viseme IDs
+async function loadVisemeManifest() {
+    if (!window.pywebview || !window.pywebview.api) {
+        window.addEventListener('pywebviewready', loadVisemeManifest, { once: true });
+        return;
+    }
+
+    let cached = null;
+    try {
+        cached = JSON.parse(localStorage.getItem(VISEME_CACHE_KEY) || 'null');
+    } catch (e) {
+        cached = null;
+    }
+    if (cached) visemeImages = cached.images;
+
+    try {
+        // The backend only sends the images again when its version differs from ours
+        const manifest = await window.pywebview.api.get_viseme_manifest(cached ? cached.version : null);
+        if (!manifest.success || manifest.unchanged) return;
+        visemeImages = manifest.images;
+        try {
+            localStorage.setItem(VISEME_CACHE_KEY, JSON.stringify({ version: manifest.version, images: manifest.images }));
+        } catch (e) {
+            console.warn('Could not cache viseme images:', e);
+        }
+    } catch (error) {
+        console.warn('Failed to load viseme images:', error);
+    }
+}
+
+// Image source of a viseme, falling back to the bundled file
+function visemeSrc(visemeId) {
+    return visemeImages[visemeId] || `visemes/viseme-id-${visemeId}.jpg`;
+}
+
+// Poll the backend while the speech model loads in the background
+async function pollModelStatus() {
+    // The pywebview bridge is injected after DOMContentLoaded
+    if (!window.pywebview || !window.pywebview.api) {
+        window.addEventListener('pywebviewready', pollModelStatus, { once: true });
+        return;
+    }
+
+    const messages = {
+        not_loaded: 'Loading speech model…',
+        loading: 'Loading speech model…',
+        warming_up: 'Warming up speech model…',
+    };
+
+    try {
+        const status = await window.pywebview.api.get_status();
+        if (status.ready) {
+            modelStatus.classList.add('hidden');
+            submitBtn.disabled = false;
+            return;
+        }
+        submitBtn.disabled = true;
+        if (status.status === 'error') {
+            modelStatus.textContent = `Speech model failed to load: ${status.error}`;
+            modelStatus.classList.add('error');
+            return;
+        }
+        modelStatus.textContent = messages[status.status] || 'Loading speech model…';
+    } catch (error) {
+        console.warn('Failed to query model status:', error);
+    }
+    setTimeout(pollModelStatus, 500);
+}
+
 // Update the sentence to practice
 function updateSentence() {
     const newSentence = sentenceInput.value.trim();
@@ -93,12 +190,14 @@ async function startRecording() {
         });
         
         // Set up Web Audio API for visualization
-        audioContext = new (window.AudioContext || window.webkitAudioContext)();
+        const source = openMicrophoneContext(stream);
         analyser = audioContext.createAnalyser();
-        const source = audioContext.createMediaStreamSource(stream);
         source.connect(analyser);
         analyser.fftSize = 512; // Increased for better frequency resolution
         analyser.smoothingTimeConstant = 0.7; // Smoother transitions
+
+        // Recognize phonemes while the learner is still speaking
+        startLiveStream(source);
         
         mediaRecorder = new MediaRecorder(stream);
         audioChunks = [];
@@ -139,6 +238,8 @@ async function startRecording() {
         
         mediaRecorder.start();
         isRecording = true;
+        partialPhonemes.textContent = '';
+        partialPhonemes.classList.remove('hidden');
         
         // Update UI
         recordBtn.classList.add('recording');
@@ -164,8 +265,10 @@ async function startRecording() {
 // Stop recording
 function stopRecording() {
     if (mediaRecorder && isRecording) {
-        mediaRecorder.stop();
         isRecording = false;
+        // Send the last samples and let the backend transcribe the tail right away
+        finishLiveStream();
+        mediaRecorder.stop();
         
         // Stop visualization
         cancelAnimationFrame(animationFrameId);
@@ -179,6 +282,174 @@ function stopRecording() {
     }
 }
 
+// Sets `audioContext` up with the microphone as its source, at 16 kHz when the browser
+// allows it so the live stream needs no resampling. Firefox creates a 16 kHz context
+// but then refuses to connect a microphone running at another rate
+// (NotSupportedError at createMediaStreamSource), so any failure falls back to a
+// context at the device's own rate, resampled in startLiveStream.
+function openMicrophoneContext(stream) {
+    const AudioContextClass = window.AudioContext || window.webkitAudioContext;
+    let context = null;
+    try {
+        context = new AudioContextClass({ sampleRate: STREAM_SAMPLE_RATE });
+        const source = context.createMediaStreamSource(stream);
+        audioContext = context;
+        return source;
+    } catch (error) {
+        console.warn('No 16 kHz audio context, resampling instead:', error);
+        if (context) context.close();
+    }
+    audioContext = new AudioContextClass();
+    return audioContext.createMediaStreamSource(stream);
+}
+
+// Open a backend stream and start capturing raw PCM from the microphone
+function startLiveStream(source) {
+    liveStreamId = null;
+    pendingPcm = [];
+    pendingSamples = 0;
+    recordedPcm = [];
+    if (!window.pywebview || !window.pywebview.api) {
+        liveStreamQueue = Promise.resolve();
+        return;
+    }
+
+    // Audio captured before the stream is open is buffered and sent once it is
+    liveStreamQueue = window.pywebview.api.start_stream()
+        .then(result => { liveStreamId = result.success ? result.request_id : null; })
+        .catch(error => console.warn('Live streaming unavailable:', error));
+
+    resampler = createResampler(audioContext.sampleRate);
+    pcmProcessor = audioContext.createScriptProcessor(4096, 1, 1);
+    pcmProcessor.onaudioprocess = (event) => {
+        if (!isRecording) return;
+        const samples = resampler(event.inputBuffer.getChannelData(0));
+        pendingPcm.push(floatToInt16(samples));
+        pendingSamples += samples.length;
+        if (pendingSamples >= STREAM_CHUNK_SAMPLES) flushLiveStream();
+    };
+    source.connect(pcmProcessor);
+    pcmProcessor.connect(audioContext.destination);
+}
+
+// Queue the buffered PCM for the backend; bridge calls are chained to keep chunks in order
+function flushLiveStream() {
+    if (pendingSamples === 0) return;
+    const chunk = new Int16Array(pendingSamples);
+    let offset = 0;
+    pendingPcm.forEach(part => { chunk.set(part, offset); offset += part.length; });
+    pendingPcm = [];
+    pendingSamples = 0;
+    recordedPcm.push(chunk);
+
+    liveStreamQueue = liveStreamQueue.then(async () => {
+        if (!liveStreamId) return;
+        const result = await window.pywebview.api.push_stream_chunk(liveStreamId, int16ToBase64(chunk));
+        if (result.success && result.partial) partialPhonemes.textContent = result.partial;
+    }).catch(error => console.warn('Failed to stream audio chunk:', error));
+}
+
+// Flush the last samples and ask the backend for the final transcription
+function finishLiveStream() {
+    if (!pcmProcessor) return;
+    flushLiveStream();
+    pcmProcessor.disconnect();
+    pcmProcessor = null;
+    liveStreamQueue = liveStreamQueue.then(async () => {
+        if (!liveStreamId) return;
+        const result = await window.pywebview.api.finish_stream(liveStreamId);
+        if (result.success) partialPhonemes.textContent = result.user_phonemes;
+    }).catch(error => console.warn('Failed to finish live stream:', error));
+}
+
+// Send a finished recording that wasn't streamed live, in large PCM chunks
+async function uploadRecording() {
+    const opened = await window.pywebview.api.start_stream();
+    if (!opened.success) throw new Error(opened.error || 'Could not open an upload stream');
+
+    const total = recordedPcm.reduce((sum, part) => sum + part.length, 0);
+    const samples = new Int16Array(total);
+    let offset = 0;
+    recordedPcm.forEach(part => { samples.set(part, offset); offset += part.length; });
+
+    for (let start = 0; start < total; start += UPLOAD_CHUNK_SAMPLES) {
+        const chunk = samples.subarray(start, start + UPLOAD_CHUNK_SAMPLES);
+        const result = await window.pywebview.api.push_stream_chunk(opened.request_id, int16ToBase64(chunk));
+        if (!result.success) throw new Error(result.error || 'Failed to upload audio');
+    }
+    return opened.request_id;
+}
+
+// Resampler of microphone chunks to 16 kHz, only used when the AudioContext isn't
+// running at 16 kHz: a windowed-sinc low-pass below the new Nyquist frequency (so
+// nothing above 8 kHz aliases into the speech band), then linear interpolation. The
+// filter history and the interpolation position carry over from chunk to chunk.
+function createResampler(sampleRate) {
+    if (sampleRate === STREAM_SAMPLE_RATE) return samples => samples;
+    const ratio = sampleRate / STREAM_SAMPLE_RATE;
+    const taps = lowPassTaps(0.45 * STREAM_SAMPLE_RATE / sampleRate, 63);
+    let history = new Float32Array(taps.length - 1);
+    let previous = 0;  // last filtered sample of the previous chunk
+    let position = 1;  // of the next output sample, where 0 is `previous`
+
+    return (samples) => {
+        const input = new Float32Array(history.length + samples.length);
+        input.set(history);
+        input.set(samples, history.length);
+        const filtered = new Float32Array(samples.length + 1);
+        filtered[0] = previous;
+        for (let i = 0; i < samples.length; i++) {
+            let sum = 0;
+            for (let k = 0; k < taps.length; k++) sum += taps[k] * input[i + k];
+            filtered[i + 1] = sum;
+        }
+        history = input.slice(samples.length);
+
+        const output = new Float32Array(Math.max(Math.ceil((filtered.length - 1 - position) / ratio), 0));
+        for (let i = 0; i < output.length; i++, position += ratio) {
+            const index = Math.floor(position);
+            output[i] = filtered[index] + (filtered[index + 1] - filtered[index]) * (position - index);
+        }
+        previous = filtered[filtered.length - 1];
+        position -= samples.length;
+        return output;
+    };
+}
+
+// Hamming-windowed sinc low-pass with unit gain; `cutoff` is in cycles per sample
+function lowPassTaps(cutoff, count) {
+    const taps = new Float32Array(count);
+    const middle = (count - 1) / 2;
+    let sum = 0;
+    for (let i = 0; i < count; i++) {
+        const x = i - middle;
+        const sinc = x === 0 ? 2 * cutoff : Math.sin(2 * Math.PI * cutoff * x) / (Math.PI * x);
+        taps[i] = sinc * (0.54 - 0.46 * Math.cos(2 * Math.PI * i / (count - 1)));
+        sum += taps[i];
+    }
+    return taps.map(tap => tap / sum);
+}
+
+// Float32 [-1, 1] -> 16-bit PCM
+function floatToInt16(samples) {
+    const output = new Int16Array(samples.length);
+    for (let i = 0; i < samples.length; i++) {
+        const clamped = Math.max(-1, Math.min(1, samples[i]));
+        output[i] = clamped < 0 ? clamped * 0x8000 : clamped * 0x7FFF;
+    }
+    return output;
+}
+
+// Little-endian 16-bit PCM -> base64, built in slices to avoid huge argument lists
+function int16ToBase64(samples) {
+    const bytes = new Uint8Array(samples.buffer, samples.byteOffset, samples.byteLength);
+    let binary = '';
+    for (let i = 0; i < bytes.length; i += 0x8000) {
+        binary += String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000));
+    }
+    return btoa(binary);
+}
+
 // Visualize audio in real-time
 function visualizeAudio() {
     if (!analyser || !isRecording) return;
@@ -250,6 +521,9 @@ function retryRecording() {
 // Reset recording state
 function resetRecordingState() {
     audioChunks = [];
+    recordedPcm = [];
+    liveStreamId = null;
+    partialPhonemes.classList.add('hidden');
     audioPlayer.classList.add('hidden');
     feedbackSection.classList.add('hidden');
     recordingControls.classList.remove('hidden');
@@ -268,7 +542,7 @@ function startNewRecording() {
 
 // Submit recording for feedback
 async function submitRecording() {
-    if (audioChunks.length === 0) {
+    if (recordedPcm.length === 0) {
         alert('No recording to submit. Please record first.');
         return;
     }
@@ -280,22 +554,15 @@ async function submitRecording() {
     if (loading) loading.classList.remove('hidden');
 
     try {
-        // Create blob from audio chunks
-        const audioBlob = new Blob(audioChunks, { type: 'audio/webm' });
-        
-        // Convert to base64
-        const base64Audio = await blobToBase64(audioBlob);
-        
-        // Also save the audio
-        await window.pywebview.api.save_audio(
-            base64Audio,
-            sentenceDisplay.textContent
-        );
-
-        // Call Python backend via pywebview API to analyze
+        await liveStreamQueue;
+        // Normally the backend already transcribed the live stream and only scores it;
+        // otherwise (stream unavailable, or a second submission) the PCM is sent again
+        const requestId = liveStreamId || await uploadRecording();
+        liveStreamId = null;
         const result = await window.pywebview.api.analyze_audio(
-            base64Audio,
-            sentenceDisplay.textContent
+            requestId,
+            sentenceDisplay.textContent,
+            ARCHIVE_RECORDINGS
         );
         
         if (result.success) {
@@ -413,18 +680,50 @@ function showFeedback(result) {
     
     feedbackContent.innerHTML = feedbackHTML;
 
-    // Populate and show the persistent final feedback box (always visible, independent of carousel)
-    const finalBox = document.getElementById('finalFeedbackBox');
-    if (finalBox) {
-        finalBox.innerHTML = messageHtml || '';
-        finalBox.classList.remove('hidden');
-    }
+    // Populate and show the persistent final feedback box (always visible, independent of carousel).
+    // When the backend streams the coaching text, chunks keep arriving through onFeedbackChunk.
+    currentFeedbackId = result.feedback_id || null;
+    feedbackText = result.message || '';
+    renderFeedbackMessage(currentFeedbackId !== null);
 
     // Set up hover interactions and carousel after content is rendered
     setupCorrectionHoverEffects();
     setupCorrectionCarousel(result);
 }
 
+// Render the (possibly partial) coaching text wherever the feedback view shows it
+function renderFeedbackMessage(pending) {
+    const messageHtml = feedbackText
+        ? markdownToHtml(feedbackText)
+        : (pending ? '<em>Generating feedback…</em>' : '');
+
+    const finalBox = document.getElementById('finalFeedbackBox');
+    if (finalBox) {
+        finalBox.innerHTML = messageHtml;
+        finalBox.classList.remove('hidden');
+    }
+    const perfectMessage = feedbackContent.querySelector('.ai-message.perfect');
+    if (perfectMessage) perfectMessage.innerHTML = messageHtml;
+}
+
+// Called by the backend (evaluate_js) for every generated chunk of coaching text
+window.onFeedbackChunk = function (feedbackId, chunk) {
+    if (feedbackId !== currentFeedbackId) return; // a newer attempt is on screen
+    feedbackText += chunk;
+    renderFeedbackMessage(true);
+};
+
+// Called by the backend once the coaching text is complete (error is null on success)
+window.onFeedbackDone = function (feedbackId, error) {
+    if (feedbackId !== currentFeedbackId) return;
+    if (error) {
+        console.error('Feedback generation failed:', error);
+        if (!feedbackText) feedbackText = 'Sorry, feedback could not be generated this time.';
+    }
+    currentFeedbackId = null;
+    renderFeedbackMessage(false);
+};
+
 // Simple HTML-escaping helper
 function escapeHtml(unsafe) {
     return unsafe
@@ -522,7 +821,7 @@ function setupCorrectionCarousel(result) {
         const c = corrections[current];
         const errorText = sentence.substring(c.start_index, c.end_index) || '';
         const type = c.type || '';
-        const imagePath = c.viseme_path;
+        const imagePath = c.viseme_id !== undefined ? visemeSrc(c.viseme_id) : null;
 
         const readableType = {
             insertion: "You added a sound",
@@ -533,8 +832,7 @@ function setupCorrectionCarousel(result) {
         let html = '<div class="viseme-card active" style="opacity:1;transform:none;">';
         html += `<div class="viseme-label"><span class="error-word">\"${escapeHtml(errorText)}\"</span><span class="error-type ${type}">${readableType}</span></div>`;
         if (imagePath) {
-            // Backend provided embedded base64 data for the image; use it directly
-            console.log('Rendering embedded viseme image (data URL)');
+            // Data URL from the viseme manifest (or the bundled file before it arrived)
             html += `<img src="${imagePath}" alt="Viseme" class="viseme-img" onerror="console.warn('Embedded image load failed', this.src); this.onerror=null; this.src='data:image/svg+xml,%3Csvg xmlns=%22http://www.w3.org/2000/svg%22 width=%22180%22 height=%22180%22%3E%3Crect fill=%23ccc width=%22180%22 height=%22180%22/%3E%3Ctext x=%2250%25%22 y=%2250%25%22 text-anchor=%22middle%22 dy=%22.3em%22 fill=%23666%3EImage not found%3C/text%3E%3C/svg%3E';"/>`;
         }
         html += `<p class="viseme-hint">Try positioning your mouth like this</p>`;
@@ -623,7 +921,7 @@ function highlightSentenceWithCorrections(sentence, corrections) {
         
         // Add highlighted correction based on type
         const errorText = sentence.substring(correction.start_index, correction.end_index);
-        const hasViseme = correction.viseme_img_path ? true : false;
+        const hasViseme = correction.viseme_id !== undefined;
         // Always attach a data-correction-index so we can reference it from the carousel
         const dataCorrectionAttr = `data-correction-index="${correctionIndex}"`;
         const dataVisemeAttr = hasViseme ? ` data-viseme-index="${visemeIndex}"` : '';
@@ -657,13 +955,3 @@ function highlightSentenceWithCorrections(sentence, corrections) {
 function updateProgress(percentage) {
     progress.style.width = `${percentage}%`;
 }
-
-// Utility function to convert audio blob to base64 (useful for API calls)
-function blobToBase64(blob) {
-    return new Promise((resolve, reject) => {
-        const reader = new FileReader();
-        reader.onloadend = () => resolve(reader.result);
-        reader.onerror = reject;
-        reader.readAsDataURL(blob);
-    });
-}
@@ -1,86 +1,548 @@
-from transformers import Wav2Vec2FeatureExtractor, Wav2Vec2CTCTokenizer,Wav2Vec2Processor, Wav2Vec2ForCTC
+from transformers import Wav2Vec2Processor, Wav2Vec2ForCTC
 from phonemizer import phonemize
 from phonemizer.separator import Separator
-import Levenshtein as lev
-import librosa
+import numpy as np
 import torch
+import threading
+import time
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 # Modules that we developed
-from backend.quen3_model import nl_feedback, viseme_path_identifier
+from backend.alignment import align
+from backend.audio import SAMPLE_RATE, load_audio, normalize, split_long_clip, trim_silence
+from backend.cache import LRUCache
+from backend.ctc import FRAME_SAMPLES, PhonemeSpans, best_path, log_posteriors
+from backend.gop import GOP_THRESHOLD, LabelMap, score_pronunciation
+from backend.inference_backends import prepare_model
+from backend.metrics import metrics
+from backend.profiling import release_memory
+from backend.phonemes import PhonemeString
+from backend.quen3_model import nl_feedback
+from backend.scheduler import BatchScheduler
+from backend.viseme_identifier import viseme_ids
 
-# Specific for my implementation on my personal computer
-os.environ['PHONEMIZER_ESPEAK_LIBRARY'] = 'C:/Program Files/eSpeak NG/libespeak-ng.dll'
+# Specific for my implementation on my personal computer (other machines find eSpeak-NG
+# on their own, and an explicit PHONEMIZER_ESPEAK_LIBRARY always wins)
+if os.name == 'nt':
+    os.environ.setdefault('PHONEMIZER_ESPEAK_LIBRARY', 'C:/Program Files/eSpeak NG/libespeak-ng.dll')
 
 class Listener():
     """
     Evaluates speech and returns feedback to
     target pronunciation points that require further work.
     """
-    def __init__(self):
+    def __init__(self, max_batch_seconds=120, backend="fp32", language="en-us", cache_dir="cache",
+                 max_clip_seconds=30, long_clips="chunk", scoring="alignment", gop_threshold=GOP_THRESHOLD,
+                 batch_window_ms=None, low_memory=False):
         self.model_name = "facebook/wav2vec2-lv-60-espeak-cv-ft"
-        self.feature_extractor = Wav2Vec2FeatureExtractor.from_pretrained(self.model_name)
-        self.tokenizer = Wav2Vec2CTCTokenizer.from_pretrained(self.model_name)
-        self.processor = Wav2Vec2Processor.from_pretrained(self.model_name, feature_extractor=self.feature_extractor, tokenizer=self.tokenizer)
-        self.model = Wav2Vec2ForCTC.from_pretrained(self.model_name)
 
-    def speech2phonemes(self, audio_path):
-        """Transforms user audio into IPA phonemes for evaluation"""
+        # For small machines: weights are memory-mapped while loading instead of copied, and
+        # freed memory goes back to the OS after every request. The backend and the clip and
+        # batch limits are left as given, so transcriptions match the normal mode's
+        self.low_memory = low_memory
+
+        # One of backend.inference_backends.BACKENDS (fp32, bf16, int8, compile, torchscript, onnx)
+        self.backend = backend
+
+        # Heavy HuggingFace objects are loaded on first use or by start_loading()
+        self.processor = None
+        self.feature_extractor = None
+        self.tokenizer = None
+        self.model = None
+        self.runner = None
+        self.vocabulary = None  # model token of every CTC label ID
+        self.label_map = None  # target phonemes -> CTC labels, for forced alignment
+        self.status = "not_loaded"  # not_loaded -> loading -> warming_up -> ready (or error)
+        self.error = None
+        self.load_lock = threading.Lock()
+
+        # Upper bound on padded audio (clips x longest clip) sent through one forward pass
+        self.max_batch_seconds = max_batch_seconds
+
+        # Speech longer than this (after trimming silence) is cut at pauses ("chunk") or refused ("reject")
+        self.max_clip_seconds = max_clip_seconds
+        self.long_clips = long_clips
+
+        # "alignment" scores the decoded phonemes against the target; "gop" force-aligns
+        # the target to the model's posteriors and reports phonemes scored under `gop_threshold`
+        if scoring not in ("alignment", "gop"):
+            raise ValueError(f"Unknown scoring mode: {scoring}")
+        self.scoring = scoring
+        self.gop_threshold = gop_threshold
+
+        # With a batching window, concurrent requests share forward passes (see backend.scheduler)
+        self.scheduler = None
+        if batch_window_ms is not None:
+            self.scheduler = BatchScheduler(lambda speeches: self._infer_batch(speeches, spans=True),
+                                            window_ms=batch_window_ms, max_batch_seconds=max_batch_seconds)
+
+        # Independent pipeline stages (eSpeak-NG) run on these threads. LLM requests get
+        # their own, so a slow Ollama call never holds up phonemization for other requests
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="listener")
+        self.feedback_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="feedback")
+
+        # Sentences are drilled over and over, so their pronunciations are memoized (and kept on disk)
+        self.language = language
+        self.pronunciations = LRUCache(
+            maxsize=4096,
+            path=os.path.join(cache_dir, "pronunciations.sqlite") if cache_dir else None,
+        )
+
+        # The listener is shared by every request, so the model and the eSpeak-NG
+        # backend are guarded; everything else in the pipeline is request-local
+        self.model_lock = threading.Lock()
+        self.phonemizer_lock = threading.Lock()
+
+    def load(self):
+        """Loads every model component exactly once and warms it up; safe to call from any thread"""
+        with self.load_lock:
+            if self.status == "ready":
+                return
+            try:
+                self.status = "loading"
+                # The processor already bundles the feature extractor and the tokenizer
+                processor = Wav2Vec2Processor.from_pretrained(self.model_name)
+                options = {}
+                if self.low_memory:
+                    # Weights are read from the memory-mapped (safetensors) checkpoint straight
+                    # into the model instead of through a second full copy in memory
+                    options["low_cpu_mem_usage"] = True
+                if self.backend == "bf16":
+                    options["torch_dtype"] = torch.bfloat16
+                model = Wav2Vec2ForCTC.from_pretrained(self.model_name, **options)
+                model, runner = prepare_model(model, self.backend)
+
+                # Run one forward pass on a second of silence and one eSpeak-NG call so the
+                # first real attempt doesn't pay for lazy allocations and library loading
+                self.status = "warming_up"
+                dummy = processor(np.zeros(SAMPLE_RATE, dtype=np.float32), sampling_rate=SAMPLE_RATE, return_tensors="pt")
+                with torch.inference_mode():
+                    runner(dummy.input_values, attention_mask=dummy.get("attention_mask"))
+                with self.phonemizer_lock:
+                    phonemize("hello", language=self.language)
+
+                self.processor = processor
+                self.feature_extractor = processor.feature_extractor
+                self.tokenizer = processor.tokenizer
+                self.vocabulary = processor.tokenizer.convert_ids_to_tokens(list(range(len(processor.tokenizer))))
+                self.label_map = LabelMap(self.vocabulary, processor.tokenizer.pad_token_id)
+                self.model = model
+                self.runner = runner
+                self.error = None
+                self.status = "ready"
+                if self.low_memory:
+                    # Loading and warming up leave freed buffers behind
+                    release_memory()
+            except Exception as e:
+                self.error = str(e)
+                self.status = "error"
+                raise
+
+    def start_loading(self):
+        """Loads the model in a background thread so the UI can come up in the meantime"""
+        def run():
+            try:
+                self.load()
+            except Exception as e:
+                print(f"Error loading the speech model: {e}")
+
+        thread = threading.Thread(target=run, name="listener-loader", daemon=True)
+        thread.start()
+        return thread
+
+    def _infer_batch(self, speeches, spans=False):
+        """
+        Runs one padded forward pass over normalized waveforms and CTC-decodes every clip.
+        With `spans`, returns a PhonemeSpans per clip (timestamps and confidences) instead.
+        """
+        if self.status != "ready":
+            self.load()
+
+        # Process input and generate logits; the attention mask keeps padding out of the model
+        with metrics.span('feature_extraction'):
+            inputs = self.processor(speeches, sampling_rate=SAMPLE_RATE, return_tensors="pt",
+                                    padding=True, return_attention_mask=True)
+        with self.model_lock, torch.inference_mode(), metrics.span('model_forward'):
+            logits = self.runner(inputs.input_values, attention_mask=inputs.attention_mask).logits
+
+        try:
+            with metrics.span('ctc_decode'):
+                lengths = self.model._get_feat_extract_output_lengths(inputs.attention_mask.sum(-1))
+                if spans:
+                    # The same logits, reduced to per-frame labels and posteriors in one pass;
+                    # the log-posteriors stay with the spans for pronunciation scoring
+                    log_probs = log_posteriors(logits)
+                    frame_ids, confidence = best_path(log_probs)
+                    blank = self.processor.tokenizer.pad_token_id
+                    return [
+                        PhonemeSpans.from_frames(frame_ids[i, :length], confidence[i, :length], blank, self.vocabulary,
+                                                 log_probs=log_probs[i, :length])
+                        for i, length in enumerate(lengths.tolist())
+                    ]
+
+                # Frames past the end of a shorter clip are forced to the blank token before decoding
+                predicted_ids = torch.argmax(logits, dim=-1)
+                padded = torch.arange(predicted_ids.shape[1])[None, :] >= lengths[:, None]
+                predicted_ids[padded] = self.processor.tokenizer.pad_token_id
+
+                # Decode the logits into phonemes and return
+                return self.processor.batch_decode(predicted_ids)
+        finally:
+            if self.low_memory:
+                # The batch's activations are freed by now; hand their pages back to the OS
+                release_memory()
+
+    def _transcribe(self, pieces):
+        """
+        PhonemeSpans of every piece, in order. Goes through the batch scheduler when
+        there is one, so pieces of concurrent requests are transcribed together.
+        """
+        if self.scheduler is None:
+            return self._infer_sorted(pieces, spans=True)
+        futures = [self.scheduler.submit(piece) for piece in pieces]
+        return [future.result() for future in futures]
+
+    def frame_posteriors(self, speech):
+        """CTC log-posteriors `[frames, vocab]` of every 20 ms frame of a 16 kHz waveform"""
+        if self.scheduler is not None:
+            return self._transcribe([speech])[0].log_probs
+        if self.status != "ready":
+            self.load()
+
+        try:
+            with metrics.span('feature_extraction'):
+                inputs = self.processor(speech, sampling_rate=SAMPLE_RATE, return_tensors="pt")
+            with self.model_lock, torch.inference_mode(), metrics.span('model_forward'):
+                logits = self.runner(inputs.input_values, attention_mask=inputs.get("attention_mask")).logits
+            return log_posteriors(logits)[0]
+        finally:
+            if self.low_memory:
+                # Same as after a batch: every streaming window's activations go back to the OS
+                release_memory()
+
+    def frame_ids(self, speech, with_confidence=False):
+        """
+        Greedy CTC label of every 20 ms frame of a 16 kHz waveform, before repeats are collapsed.
+        `with_confidence` also returns the posterior probability of each label.
+        """
+        frame_ids, confidence = best_path(self.frame_posteriors(speech))
+        if with_confidence:
+            return frame_ids, confidence
+        return frame_ids
+
+    def decode_ids(self, frame_ids):
+        """CTC-decodes frame labels (collapsing repeats and blanks) into a phoneme string"""
+        return self.processor.decode(frame_ids)
+
+    def _prepare(self, audio, stats=None):
+        """
+        Loads, normalizes and trims one recording, returning the pieces to transcribe
+        and where each starts in the recording (in samples).
+        Leading and trailing silence never reaches the model, and clips longer than
+        `max_clip_seconds` are either rejected or cut at pauses.
+        """
         # Load and normalize the user's audio
-        speech, sr = librosa.load(audio_path, sr=16_000, mono=True)
-        speech = librosa.util.normalize(speech)
+        with metrics.span('resample_normalize'):
+            speech = normalize(load_audio(audio, sr=SAMPLE_RATE))
+        with metrics.span('vad'):
+            trimmed, trim_start, _ = trim_silence(speech)
 
-        # Process input and generate logits
-        inputs = self.processor(speech, sampling_rate=16_000, return_tensors="pt", padding=True)
-        with torch.no_grad():
-            logits = self.model(inputs.input_values).logits
+        # Report how much audio (and therefore attention cost) was saved
+        removed = (len(speech) - len(trimmed)) / SAMPLE_RATE
+        metrics.record('vad_trimmed_seconds', removed)
+        if stats is not None:
+            stats['audio_kept'] = len(trimmed) / SAMPLE_RATE
+            stats['audio_trimmed'] = removed
+
+        if len(trimmed) == 0:
+            return [], []
+        max_samples = int(self.max_clip_seconds * SAMPLE_RATE)
+        if len(trimmed) <= max_samples:
+            return [trimmed], [trim_start]
+        if self.long_clips == "reject":
+            raise ValueError(f"Recording is too long ({len(trimmed) / SAMPLE_RATE:.0f} s of speech, "
+                             f"the limit is {self.max_clip_seconds} s)")
+        pieces = split_long_clip(trimmed, max_samples)
+        offsets = trim_start + np.concatenate([[0], np.cumsum([len(piece) for piece in pieces[:-1]])])
+        return pieces, offsets.tolist()
+
+    def _infer_sorted(self, speeches, max_batch_seconds=None, spans=False):
+        """
+        Transcribes many waveforms, returned in the input order (as PhonemeSpans with `spans`).
+        Waveforms are sorted by length and grouped so that the padded audio of a batch
+        stays under `max_batch_seconds`.
+        """
+        max_samples = (max_batch_seconds or self.max_batch_seconds) * SAMPLE_RATE
+
+        # Sorting by length keeps clips of similar size together, which minimizes padding
+        order = sorted(range(len(speeches)), key=lambda i: len(speeches[i]))
+        phonemes = [None] * len(speeches)
+
+        batch = []
+        for i in order:
+            # A batch costs as much as its longest (i.e. latest) clip times its size
+            if batch and len(speeches[i]) * (len(batch) + 1) > max_samples:
+                for j, decoded in zip(batch, self._infer_batch([speeches[j] for j in batch], spans)):
+                    phonemes[j] = decoded
+                batch = []
+            batch.append(i)
+
+        if batch:
+            for j, decoded in zip(batch, self._infer_batch([speeches[j] for j in batch], spans)):
+                phonemes[j] = decoded
 
-        # Decode the logits into phonemes and return
-        predicted_ids = torch.argmax(logits, dim=-1)
-        phonemes = self.processor.batch_decode(predicted_ids)[0]
-        
         return phonemes
-    
+
+    def speech2phonemes(self, audio, stats=None):
+        """
+        Transforms user audio into IPA phonemes for evaluation.
+        `audio` can be a 16 kHz float32 waveform, an encoded bytes buffer or a file path.
+        Pass a dict as `stats` to receive the seconds of audio kept and trimmed.
+        """
+        pieces, _ = self._prepare(audio, stats)
+        if self.scheduler is not None:
+            return " ".join(spans.text() for spans in self._transcribe(pieces))
+        if len(pieces) == 1:
+            return self._infer_batch(pieces)[0]
+        return " ".join(self._infer_sorted(pieces))
+
+    def speech2spans(self, audio, stats=None):
+        """
+        Like speech2phonemes, but returns time-aligned PhonemeSpans (see backend.ctc):
+        every phoneme with its start and end frame in the original recording and its
+        mean posterior confidence. `spans.text()` is the phoneme string.
+        """
+        pieces, offsets = self._prepare(audio, stats)
+        if self.status != "ready":
+            self.load()
+        spans = self._transcribe(pieces)
+        # Frames are counted from the start of the recording, before silence was trimmed
+        for piece_spans, offset in zip(spans, offsets):
+            piece_spans.shift(offset // FRAME_SAMPLES)
+        return PhonemeSpans.concatenate(spans, self.vocabulary)
+
+    def speech2phonemes_batch(self, audios, max_batch_seconds=None):
+        """
+        Transforms many recordings into IPA phonemes, returned in the input order.
+        Clips are sorted by length and grouped so that the padded audio of a batch
+        stays under `max_batch_seconds`.
+        """
+        # Long clips may come back as several pieces; remember which recording each belongs to
+        pieces, owners = [], []
+        for i, audio in enumerate(audios):
+            for piece in self._prepare(audio)[0]:
+                pieces.append(piece)
+                owners.append(i)
+
+        phonemes = [[] for _ in audios]
+        for owner, decoded in zip(owners, self._infer_sorted(pieces, max_batch_seconds)):
+            phonemes[owner].append(decoded)
+        return [" ".join(parts) for parts in phonemes]
+
+    def pronunciation_key(self, text):
+        """Cache key of a sentence: whitespace-normalized text plus the eSpeak-NG language"""
+        return f"{self.language}:{' '.join(text.split())}"
+
+    def text2words(self, text):
+        """Converts text into IPA phonemes using eSpeak-NG, one entry per word"""
+        key = self.pronunciation_key(text)
+        phonemes = self.pronunciations.get(key)
+        if phonemes is None:
+            with self.phonemizer_lock, metrics.span('phonemize'):
+                phonemes = phonemize(text, language=self.language).strip()
+            self.pronunciations.set(key, phonemes)
+        return phonemes.split()
+
     def text2phonemes(self, text):
         """Converts text into IPA phonemes using eSpeak-NG"""
-        phonemes = phonemize(text, language='en-us').replace(' ', '')
-        return phonemes
-    
+        # The cache keeps word boundaries; the phoneme string shown to the learner doesn't
+        return ''.join(self.text2words(text))
+
+    def prephonemize(self, sentences):
+        """Warms the pronunciation cache for a whole lesson with one batched eSpeak-NG call"""
+        missing = {}
+        for sentence in sentences:
+            key = self.pronunciation_key(sentence)
+            if key not in missing and key not in self.pronunciations:
+                missing[key] = ' '.join(sentence.split())
+        if not missing:
+            return 0
+
+        with self.phonemizer_lock, metrics.span('phonemize_batch'):
+            phonemes = phonemize(list(missing.values()), language=self.language)
+        self.pronunciations.set_many(zip(missing.keys(), (p.strip() for p in phonemes)))
+        return len(missing)
+
+    def align(self, user_phonemes, target_phonemes, target_words=None):
+        """
+        Phoneme-level alignment of an attempt against the target (see backend.alignment).
+        `target_words`, the target split into words, adds word-level spans.
+        """
+        return align(target_phonemes, user_phonemes, target_words)
+
     def get_misalignments(self, user_phonemes, target_phonemes):
         """Evaluates alignment between two phoneme sequences"""
-        # Get the Levenshtein alignment codes
-        opcodes = lev.opcodes(target_phonemes, user_phonemes)
-        # Compute a percentage similarity based on Levenshtein distance
-        distance = lev.distance(target_phonemes, user_phonemes)
-        similarity = round(100 - distance/max(len(user_phonemes), len(target_phonemes))*100)
-
-        matches = []
-        substitutions = []
-        deletions = []
-        insertions = []
-                
-        # Extract matches and various kinds of errors
-        for op, ref_start, ref_end, user_start, user_end in opcodes:
-            # Encode as reference indices and attempt indices
-            indices = ((ref_start, ref_end), (user_start, user_end))
-
-            if op == 'equal':
-                matches.append(indices)
-            elif op == 'replace':
-                substitutions.append(indices)
-            elif op == 'delete':
-                deletions.append(indices)
-            elif op == 'insert':
-                insertions.append(indices)
-
-        return similarity, matches, substitutions, deletions, insertions
-    
+        alignment = self.align(user_phonemes, target_phonemes)
+        # Spans are encoded as reference indices and attempt indices
+        return alignment.similarity, alignment.matches, alignment.substitutions, alignment.deletions, alignment.insertions
+
+    def score_pronunciation(self, user_spans, target_phonemes, target_words=None):
+        """
+        Goodness of pronunciation of every target phoneme (see backend.gop), from the
+        log-posteriors the attempt's PhonemeSpans kept from its forward pass.
+        Returns None when the spans have no posteriors or the target doesn't fit the recording.
+        """
+        if self.status != "ready":
+            self.load()
+        if not isinstance(target_phonemes, PhonemeString):
+            target_phonemes = PhonemeString(target_phonemes, target_words)
+        return score_pronunciation(user_spans, target_phonemes, self.label_map, self.gop_threshold)
+
+    def _timed_feedback(self, reference_text, target_phonemes, user_phonemes, errors, timings):
+        with metrics.span('nl_feedback', timings):
+            return nl_feedback(reference_text, target_phonemes, user_phonemes, errors)
 
     def get_feedback(self, phoneme):
         """Returns the corresponding feedback to help understand a phoneme"""
     
-    def __call__(self, reference_text, audio_path):
-        """Makes the whole pipeline run from start to finish"""
+    def _align(self, reference_text, audio, timings=None, user_phonemes=None):
+        """
+        Step 1-2 of the pipeline. eSpeak-NG runs on a worker thread while wav2vec2
+        transcribes the audio, since the target phonemes don't depend on the recording.
+        `user_phonemes` (a string or PhonemeSpans) skips the acoustic model when the
+        audio was already transcribed (e.g. by a StreamingRecognizer).
+        """
+        # Generate phonemes from audio and reference text
+        target_future = self.executor.submit(self._timed_text2words, reference_text, timings)
+        user_spans = None
+        if user_phonemes is None:
+            with metrics.span('speech2phonemes', timings):
+                user_phonemes = self.speech2spans(audio, stats=timings)
+        if isinstance(user_phonemes, PhonemeSpans):
+            user_spans, user_phonemes = user_phonemes, user_phonemes.text()
+        target_words = target_future.result()
+        target_phonemes = ''.join(target_words)
+
+        # Step 2. Get similarity misalignment indices between attempt and target
+        with metrics.span('alignment', timings):
+            alignment = self.align(user_phonemes, target_phonemes, target_words)
+
+        # In GOP mode the forced alignment decides which target phonemes were mispronounced
+        gop = None
+        if self.scoring == "gop" and user_spans is not None:
+            with metrics.span('gop', timings):
+                gop = self.score_pronunciation(user_spans, alignment.target)
+
+        if gop is not None:
+            errors = [alignment.target.tokens[token] for token in np.flatnonzero(gop.flagged)]
+        else:
+            errors = [target_phonemes[deletion[0][0]:deletion[0][1]] for deletion in alignment.deletions] + [target_phonemes[sub[0][0]:sub[0][1]] for sub in alignment.substitutions]
+        return alignment, target_words, user_phonemes, user_spans, gop, errors
+
+    def _timed_text2words(self, reference_text, timings):
+        with metrics.span('text2phonemes', timings):
+            return self.text2words(reference_text)
+
+    def analyze(self, reference_text, audio, timings=None, user_phonemes=None):
+        """
+        Runs everything but the LLM feedback, so the score and corrections can be shown
+        right away. Returns the corrections plus the error spans to give `nl_feedback`.
+        Pass a dict as `timings` to receive the duration of every stage in seconds.
+        """
+        alignment, target_words, user_phonemes, user_spans, gop, errors = self._align(reference_text, audio, timings, user_phonemes)
+        with metrics.span('visemes', timings):
+            substituted, inserted, deleted = self._corrections(alignment, target_words, user_spans, gop)
+        similarity = gop.score if gop is not None else alignment.similarity
+        return similarity, substituted, inserted, deleted, ''.join(target_words), user_phonemes, errors
+
+    def _corrections(self, alignment, target_words, user_spans=None, gop=None):
+        """
+        Bundles the error spans into correction entries with their viseme IDs.
+        With the `user_spans` of the attempt, every entry also gets the `time` range
+        (in seconds) of the recording where the mistake was made.
+        With `gop` (PronunciationScores), the target phonemes it flags are reported
+        instead, typed by the alignment where it agrees, each with its `gop` score.
+        """
+        # IMPORTANT NOTE: Error indices are packed as [((ref_start, ref_end), (att_start, att_end))]
+        target = alignment.target
+        # The target was tokenized once for the alignment; its visemes come out of one lookup
+        visemes = viseme_ids(target)
+
+        def word_info(ref_start, ref_end):
+            # Which target words the error falls in, so the UI can point at them
+            words = alignment.words_of(ref_start, ref_end)
+            if words is None:
+                return {}
+            return {'word_index': list(words), 'word': ' '.join(target_words[words[0]:words[1] + 1])}
+
+        def time_info(user_start, user_end):
+            time_range = user_spans.locate(user_start, user_end) if user_spans is not None else None
+            return {'time': list(time_range)} if time_range is not None else {}
+
+        def correction(token, kind, heard):
+            start, end = int(target.starts[token]), int(target.ends[token])
+            entry = {
+                'viseme_id': int(visemes[token]),
+                'start_index': start,
+                'end_index': end,
+                'type': kind,
+                'correct': target.tokens[token],
+                **word_info(start, end),
+                **heard
+            }
+            if gop is not None:
+                entry['gop'] = round(float(gop.gop[token]), 3)
+            return entry
+
+        def per_phoneme(spans, kind):
+            # One correction per phoneme of the span, each with its own viseme and
+            # character range, so the frontend can render and highlight them separately
+            corrections = []
+            for (ref_start, ref_end), (user_start, user_end) in spans:
+                heard = time_info(user_start, user_end)
+                first, last = target.token_range(ref_start, ref_end)
+                for token in range(first, last):
+                    corrections.append(correction(token, kind, heard))
+            return corrections
+
+        if gop is None:
+            substituted = per_phoneme(alignment.substitutions, 'substitution')
+            deleted = per_phoneme(alignment.deletions, 'deletion')
+        else:
+            # Decoder slips on phonemes that scored well are dropped, and phonemes that
+            # scored badly are reported even where the decoder happened to match them
+            deleted_tokens = set()
+            for (ref_start, ref_end), _ in alignment.deletions:
+                deleted_tokens.update(range(*target.token_range(ref_start, ref_end)))
+            substituted, deleted = [], []
+            for token in np.flatnonzero(gop.flagged).tolist():
+                time_range = gop.locate(token)
+                heard = {'time': list(time_range)} if time_range is not None else {}
+                if token in deleted_tokens:
+                    deleted.append(correction(token, 'deletion', heard))
+                else:
+                    substituted.append(correction(token, 'substitution', heard))
+
+        # Bundle up my insertions (no viseme images expected)
+        inserted = []
+        for (ref_start, ref_end), (user_start, user_end) in alignment.insertions:
+            inserted.append({
+                'start_index': ref_start,
+                'end_index': ref_end,
+                'type': 'insertion',
+                **word_info(ref_start, ref_end),
+                **time_info(user_start, user_end)
+            })
+
+        return substituted, inserted, deleted
+
+    def __call__(self, reference_text, audio, timings=None):
+        """
+        Makes the whole pipeline run from start to finish.
+        The LLM request starts as soon as the errors are known and the viseme lookup
+        runs while it is in flight. Pass a dict as `timings` for a per-stage breakdown.
+        """
 
         """
         # Step 1. Get the user's phonemes and the reference phonemes
@@ -147,85 +609,53 @@ class Listener():
         return similarity, substituted, inserted, deleted, feedback, target_phonemes
         """
 
-        # Generate phonemes from audio and reference text
-        user_phonemes = self.speech2phonemes(audio_path)
-        target_phonemes = self.text2phonemes(reference_text)
+        # Step 1-2. Acoustic analysis and alignment
+        start = time.perf_counter()
+        alignment, target_words, user_phonemes, user_spans, gop, errors = self._align(reference_text, audio, timings)
+        similarity = gop.score if gop is not None else alignment.similarity
+        target_phonemes = ''.join(target_words)
 
-        # Step 2. Get similarity misalignment indices between attempt and target
-        similarity, matches, substitutions, deletions, insertions = self.get_misalignments(user_phonemes, target_phonemes)
-
-        # IMPORTANT NOTE: Error indices are packed as [((ref_start, ref_end), (att_start, att_end))]
+        # Step 3. Natural-language coaching, overlapped with the viseme lookup
+        feedback_future = self.feedback_executor.submit(self._timed_feedback, reference_text, target_phonemes, user_phonemes, errors, timings)
+        with metrics.span('visemes', timings):
+            substituted, inserted, deleted = self._corrections(alignment, target_words, user_spans, gop)
+        feedback = feedback_future.result()
 
-        # Bundle up substitutions: if the viseme identifier returns multiple paths,
-        # emit one correction entry per viseme so the frontend can render each separately.
-        substituted = []
-        for substitution in substitutions:
-            ref_start, ref_end = substitution[0][0], substitution[0][1]
-            viseme_paths = viseme_path_identifier(target_phonemes[ref_start:ref_end])
-            # If viseme_paths is a list, create one correction per path
-            if isinstance(viseme_paths, (list, tuple)) and len(viseme_paths) > 0:
-                for vp in viseme_paths:
-                    substituted.append({
-                        'viseme_path': vp,
-                        'start_index': ref_start,
-                        'end_index': ref_end,
-                        'type': 'substitution',
-                        'correct': target_phonemes[ref_start:ref_end]
-                    })
-            else:
-                # fallback, keep single entry with whatever was returned
-                substituted.append({
-                    'viseme_path': viseme_paths,
-                    'start_index': ref_start,
-                    'end_index': ref_end,
-                    'type': 'substitution',
-                    'correct': target_phonemes[ref_start:ref_end]
-                })
-
-        # Bundle up my insertions (no viseme images expected)
-        inserted = []
-        for insertion in insertions:
-            ref_start, ref_end = insertion[0][0], insertion[0][1]
-            inserted.append({
-                'start_index': ref_start,
-                'end_index': ref_end,
-                'type': 'insertion',
-            })
-
-        # Bundle up deletions similarly to substitutions (may have visemes)
-        deleted = []
-        for deletion in deletions:
-            ref_start, ref_end = deletion[0][0], deletion[0][1]
-            viseme_paths = viseme_path_identifier(target_phonemes[ref_start:ref_end])
-            if isinstance(viseme_paths, (list, tuple)) and len(viseme_paths) > 0:
-                for vp in viseme_paths:
-                    deleted.append({
-                        'viseme_path': vp,
-                        'start_index': ref_start,
-                        'end_index': ref_end,
-                        'type': 'deletion',
-                        'correct': target_phonemes[ref_start:ref_end]
-                    })
-            else:
-                deleted.append({
-                    'viseme_path': viseme_paths,
-                    'start_index': ref_start,
-                    'end_index': ref_end,
-                    'type': 'deletion',
-                    'correct': target_phonemes[ref_start:ref_end]
-                })
-
-        errors = [target_phonemes[deletion[0][0]:deletion[0][1]] for deletion in deletions] + [target_phonemes[sub[0][0]:sub[0][1]] for sub in substitutions]
-        feedback = nl_feedback(reference_text, target_phonemes, user_phonemes, errors)
+        elapsed = time.perf_counter() - start
+        metrics.record('total', elapsed)
+        if timings is not None:
+            timings['total'] = elapsed
 
         # Target these variables to return
         return similarity, substituted, inserted, deleted, feedback, target_phonemes, user_phonemes
     
-listener = Listener()
+# Cheap to create: the model itself is loaded lazily (see Listener.start_loading)
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def get_listener():
+    """
+    The app's shared Listener, configured from the SPEECHTEACHER_* environment variables.
+    Built on first use, so importing this module (e.g. in a worker process that builds
+    its own Listener) loads nothing and opens no pronunciation cache.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = Listener(
+                backend=os.environ.get("SPEECHTEACHER_BACKEND", "fp32"),
+                scoring=os.environ.get("SPEECHTEACHER_SCORING", "alignment"),
+                # e.g. 30 to batch the requests arriving within 30 ms of each other
+                batch_window_ms=float(os.environ.get("SPEECHTEACHER_BATCH_WINDOW_MS") or 0) or None,
+                low_memory=os.environ.get("SPEECHTEACHER_LOW_MEMORY", "0") not in ("", "0"),
+            )
+        return _listener
+
 
 if __name__ == "__main__":
     audio_path = 'test.wav' # Audio of reference_speech
     reference_speech = 'Anthony likes apple pie'
-    output = listener(reference_speech, audio_path)
+    output = get_listener()(reference_speech, audio_path)
 
     print(output)
\ No newline at end of file
@@ -0,0 +1,626 @@
+"""
+Headless multi-user server: the same frontend, served to any number of browsers.
+
+    python server.py --host 0.0.0.0 --port 8000 --workers 2 --queue 8
+    python server.py --workers 1 --threads 8 --batch-window-ms 30
+
+The frontend is served as static files, with a small shim (frontend/http_bridge.js)
+standing in for the pywebview bridge: every `window.pywebview.api.<method>(...)`
+call becomes `POST /api/<method>` with the arguments as a JSON list, and the calls
+the desktop app pushes into the window (the streamed coaching text) are long-polled
+from `GET /api/events`. Each browser keeps a session ID, sent as `X-Session-Id`,
+which also names the learner's history and LLM conversation.
+
+Recognition runs in a pool of worker processes, each holding its own model and
+running up to `--threads` attempts at once. With `--batch-window-ms`, the attempts a
+worker runs concurrently are micro-batched into shared forward passes (see
+backend/scheduler.py). At most `--queue` attempts wait for a free worker thread; past
+that `analyze_audio` is answered with 503 and a Retry-After header, and the shim retries. Recordings are buffered here while
+they are uploaded and transcribed once when submitted, so there are no partial
+transcriptions (and nothing is archived) in server mode.
+"""
+import argparse
+import base64
+import json
+import mimetypes
+import multiprocessing
+import itertools
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from backend.audio import SAMPLE_RATE
+from backend.history_store import HistoryStore
+from backend.metrics import metrics
+from backend.profiling import PeakRSS
+from backend.quen3_model import feedback_cache, nl_feedback_stream
+from backend.viseme_assets import viseme_assets
+from backend.workers import init_worker, worker_ready
+
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend")
+RECORDINGS_DIR = "recordings"
+
+# Limits per session and per request
+MAX_SESSIONS = 1024
+SESSION_TTL = 3600  # seconds without any request before a session is dropped
+MAX_OPEN_STREAMS = 4
+MAX_STREAM_SECONDS = 120
+MAX_BODY_BYTES = 8 * 1024 * 1024
+MAX_BUFFERED_SECONDS = 1800  # PCM held in open recordings across every session (about 58 MB)
+EVENTS_TIMEOUT = 25  # seconds a long poll is held open
+KEPT_EVENTS = 512
+
+SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+def analyze_recording(sentence, pcm):
+    """Scores one attempt inside a worker; `pcm` is 16 kHz 16-bit mono PCM"""
+    from backend import workers
+    from backend.audio import pcm16_to_array
+
+    started = time.time()
+    timings = {}
+    # The worker's own memory, so the report shows what a model process peaks at while
+    # running this request (alongside any it runs concurrently)
+    with PeakRSS() as memory:
+        score, substituted, inserted, deleted, target_phonemes, user_phonemes, errors = workers.worker_listener.analyze(
+            sentence, pcm16_to_array(pcm), timings
+        )
+    return {
+        "started": started,
+        "memory": memory.report(),
+        "score": score,
+        "substituted": substituted,
+        "inserted": inserted,
+        "deleted": deleted,
+        "target_phonemes": target_phonemes,
+        "user_phonemes": user_phonemes,
+        "errors": errors,
+        "timings": timings,
+    }
+
+
+class ServerBusy(Exception):
+    """Every worker is busy and the request queue is full"""
+
+
+def worker_main(options, threads, jobs, results):
+    """
+    Body of one worker process: loads the model, then runs up to `threads` attempts at
+    once, so that with a `batch_window_ms` the Listener's BatchScheduler can put
+    concurrent attempts through one forward pass. A job is only taken from the shared
+    queue when a thread is free, so an idle worker is never starved by a busy one.
+    """
+    try:
+        init_worker(options)
+    except Exception as e:
+        results.put((None, False, str(e)))
+        return
+    results.put((None, True, worker_ready()))
+
+    free = threading.Semaphore(threads)
+    executor = ThreadPoolExecutor(threads)
+
+    def run(job_id, fn, args):
+        try:
+            results.put((job_id, True, fn(*args)))
+        except Exception as e:
+            traceback.print_exc()
+            results.put((job_id, False, str(e)))
+        finally:
+            free.release()
+
+    while True:
+        free.acquire()
+        job = jobs.get()
+        if job is None:
+            break
+        executor.submit(run, *job)
+
+
+class WorkerPool:
+    """
+    Model-holding worker processes behind a bounded queue: at most
+    `workers * threads + queue_size` attempts are accepted at once and `submit` raises
+    ServerBusy beyond that, so a burst of submissions is turned away early instead of
+    piling up unbounded latency. `options` are the workers' Listener keyword arguments.
+    """
+    def __init__(self, workers, queue_size, threads=1, **options):
+        self.workers = workers
+        self.threads = threads
+        self.capacity = workers * threads + queue_size
+        self.slots = threading.BoundedSemaphore(self.capacity)
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.status = "loading"
+        self.error = None
+        self.closed = False
+
+        context = multiprocessing.get_context("spawn")
+        self.jobs = context.Queue()
+        self.results = context.Queue()
+        self.futures = {}  # job ID -> Future, until the worker answers
+        self.job_ids = itertools.count()
+        self.processes = [
+            context.Process(target=worker_main, args=(options, threads, self.jobs, self.results),
+                            name=f"worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+    def start(self):
+        """Starts every worker in the background; `status` turns ready once one has its model"""
+        for process in self.processes:
+            process.start()
+        threading.Thread(target=self._collect, name="worker-results", daemon=True).start()
+
+    def _collect(self):
+        """Resolves the futures of finished jobs, and fails them all if a worker dies"""
+        while not self.closed:
+            try:
+                job_id, ok, value = self.results.get(timeout=1)
+            except queue.Empty:
+                dead = next((p for p in self.processes if p.exitcode is not None), None)
+                if dead is not None and not self.closed:
+                    self._fail(f"Worker {dead.name} exited with code {dead.exitcode}")
+                    return
+                continue
+
+            if job_id is None:  # a worker finished loading
+                if not ok:
+                    self._fail(value)
+                    return
+                if self.status == "loading":
+                    self.status = "ready"
+                continue
+            with self.lock:
+                future = self.futures.pop(job_id, None)
+            if future is not None:
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(RuntimeError(value))
+
+    def _fail(self, error):
+        if self.status != "error" and not self.closed:
+            print(f"Error in workers: {error}")
+        self.error = error
+        self.status = "error"
+        with self.lock:
+            futures, self.futures = self.futures, {}
+        for future in futures.values():
+            future.set_exception(RuntimeError(error))
+
+    def submit(self, fn, *args):
+        """Queues `fn(*args)` for a worker thread; `fn` must be importable by the workers"""
+        if not self.slots.acquire(blocking=False):
+            metrics.record('server_rejected', 1)
+            raise ServerBusy()
+        future = Future()
+        future.add_done_callback(lambda _: self._release())
+        with self.lock:
+            self.pending += 1
+            broken = self.status == "error"
+            if not broken:
+                job_id = next(self.job_ids)
+                self.futures[job_id] = future
+        if broken:
+            future.set_exception(RuntimeError(self.error))
+        else:
+            self.jobs.put((job_id, fn, args))
+        return future
+
+    def _release(self):
+        with self.lock:
+            self.pending -= 1
+        self.slots.release()
+
+    def stats(self):
+        return {"workers": self.workers, "threads": self.threads, "capacity": self.capacity, "pending": self.pending}
+
+    def shutdown(self):
+        self.closed = True
+        for process in self.processes:
+            process.terminate()
+        self.jobs.cancel_join_thread()  # jobs nobody will take must not block the exit
+        self._fail("Server is shutting down")
+
+
+class Session:
+    """
+    One browser: its open recordings (raw PCM, by request ID) and the queue of calls
+    pushed to its window, numbered so a long poll can ask for everything after the
+    last one it saw.
+    """
+    def __init__(self, session_id):
+        self.id = session_id
+        self.streams = OrderedDict()
+        self.events = deque(maxlen=KEPT_EVENTS)  # (sequence, function, args)
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.last_seen = time.monotonic()
+
+    def push(self, function, *args):
+        with self.changed:
+            self.sequence += 1
+            self.events.append((self.sequence, function, list(args)))
+            self.changed.notify_all()
+
+    def events_since(self, since, timeout=EVENTS_TIMEOUT):
+        """Waits up to `timeout` seconds for calls after `since`; returns them and the new cursor"""
+        with self.changed:
+            if since > self.sequence:
+                since = 0  # the server restarted since the browser's last poll
+            self.changed.wait_for(lambda: self.sequence > since, timeout)
+            events = [[function, args] for sequence, function, args in self.events if sequence > since]
+            return events, self.sequence
+
+
+class Sessions:
+    """
+    Sessions by ID, created on first use; the least recently seen are dropped past the limits.
+    Also accounts for the PCM buffered in open recordings across all sessions, so uploads
+    are turned away (ServerBusy) once `max_buffered_bytes` are held.
+    """
+    def __init__(self, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL,
+                 max_buffered_bytes=MAX_BUFFERED_SECONDS * SAMPLE_RATE * 2):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.max_buffered_bytes = max_buffered_bytes
+        self.buffered_bytes = 0
+        self.buffer_lock = threading.Lock()  # taken last, after Sessions.lock and Session.lock
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self.sessions[session_id] = Session(session_id)
+            session.last_seen = now
+            self.sessions.move_to_end(session_id)
+            while self.sessions:
+                oldest = next(iter(self.sessions.values()))
+                if len(self.sessions) <= self.max_sessions and now - oldest.last_seen < self.ttl:
+                    break
+                _, dropped = self.sessions.popitem(last=False)
+                with dropped.lock:
+                    # Cleared, so requests still holding the session cannot buffer any more
+                    self.release(sum(len(stream) for stream in dropped.streams.values()))
+                    dropped.streams.clear()
+            return session
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def full(self):
+        with self.buffer_lock:
+            return self.buffered_bytes >= self.max_buffered_bytes
+
+    def reserve(self, nbytes):
+        """Counts `nbytes` more of buffered PCM; raises ServerBusy if that would exceed the limit"""
+        with self.buffer_lock:
+            if self.buffered_bytes + nbytes > self.max_buffered_bytes:
+                metrics.record('server_rejected', 1)
+                raise ServerBusy()
+            self.buffered_bytes += nbytes
+
+    def release(self, nbytes):
+        with self.buffer_lock:
+            self.buffered_bytes -= nbytes
+
+
+class ServerAPI:
+    """
+    The methods of app.API the frontend calls, with the session of the calling browser
+    as first argument. Inference goes to the worker pool; feedback and history stay here.
+    """
+    exposed = ("get_status", "get_metrics", "get_viseme_manifest", "get_progress",
+               "start_stream", "push_stream_chunk", "finish_stream", "analyze_audio")
+
+    def __init__(self, pool, history):
+        self.pool = pool
+        self.history = history
+        self.sessions = Sessions()
+
+    def _stream_feedback(self, session, feedback_id, sentence, target_phonemes, user_phonemes, errors):
+        """Queues the LLM feedback for the session's long poll chunk by chunk as it is generated"""
+        try:
+            for chunk in nl_feedback_stream(sentence, target_phonemes, user_phonemes, errors, session_id=session.id):
+                session.push("onFeedbackChunk", feedback_id, chunk)
+            session.push("onFeedbackDone", feedback_id, None)
+        except Exception as e:
+            print(f"Error streaming feedback: {str(e)}")
+            session.push("onFeedbackDone", feedback_id, str(e))
+
+    def get_status(self, session):
+        """Reports whether the workers have loaded the speech model"""
+        return {"status": self.pool.status, "ready": self.pool.status == "ready", "error": self.pool.error,
+                **self.pool.stats()}
+
+    def get_metrics(self, session):
+        """Latency percentiles (seconds) of the server's stages, plus pool and cache state"""
+        return {
+            "spans": metrics.summary(),
+            "pool": self.pool.stats(),
+            "sessions": len(self.sessions),
+            "buffered_seconds": self.sessions.buffered_bytes / (SAMPLE_RATE * 2),
+            "caches": {"feedback": feedback_cache.stats()},
+        }
+
+    def get_viseme_manifest(self, session, version=None):
+        """All viseme images as data URLs keyed by ID (see app.API.get_viseme_manifest)"""
+        manifest = viseme_assets.manifest()
+        if version == manifest["version"]:
+            return {"success": True, "version": version, "unchanged": True}
+        return {"success": True, **manifest}
+
+    def get_progress(self, session, learner=None, days=30):
+        """
+        Most-missed phonemes and daily scores of the session's learner.
+        `learner` is only there to match app.API; a browser only ever sees its own session.
+        """
+        return {
+            "success": True,
+            "most_missed": self.history.most_missed_phonemes(session.id, days),
+            "daily": self.history.daily_scores(session.id, days),
+        }
+
+    def start_stream(self, session):
+        """
+        Opens a recording that is uploaded in PCM chunks. Raises ServerBusy (503) while
+        the recordings of all sessions already hold MAX_BUFFERED_SECONDS of audio.
+        """
+        if self.sessions.full():
+            metrics.record('server_rejected', 1)
+            raise ServerBusy()
+        request_id = uuid.uuid4().hex
+        with session.lock:
+            session.streams[request_id] = bytearray()
+            while len(session.streams) > MAX_OPEN_STREAMS:
+                _, evicted = session.streams.popitem(last=False)
+                self.sessions.release(len(evicted))
+        return {"success": True, "request_id": request_id}
+
+    def push_stream_chunk(self, session, request_id, pcm_base64):
+        """
+        Appends base64-encoded 16 kHz 16-bit PCM to an open recording. Raises ServerBusy
+        (503) if the chunk does not fit under MAX_BUFFERED_SECONDS; it can be resent.
+        """
+        pcm = base64.b64decode(pcm_base64)
+        with session.lock:
+            stream = session.streams.get(request_id)
+            if stream is None:
+                return {"success": False, "error": f"Unknown stream: {request_id}"}
+            if len(stream) + len(pcm) > MAX_STREAM_SECONDS * SAMPLE_RATE * 2:
+                return {"success": False, "error": f"Recording is longer than {MAX_STREAM_SECONDS} s"}
+            self.sessions.reserve(len(pcm))
+            stream += pcm
+        # Recordings are only transcribed once submitted, so there is no partial hypothesis
+        return {"success": True, "partial": ""}
+
+    def finish_stream(self, session, request_id):
+        with session.lock:
+            if request_id not in session.streams:
+                return {"success": False, "error": f"Unknown stream: {request_id}"}
+        return {"success": True, "user_phonemes": ""}
+
+    def analyze_audio(self, session, request_id, sentence, archive=False, learner=None):
+        """
+        Scores an uploaded recording on a worker, like app.API.analyze_audio, for the
+        session's learner. Raises ServerBusy (503) when the queue is full; the recording
+        is kept so the same request can be retried.
+        """
+        sentence = sentence.strip()
+        with session.lock:
+            pcm = session.streams.get(request_id)
+        if not pcm:
+            return {"success": False, "error": "No audio data provided"}
+
+        submitted = time.time()
+        future = self.pool.submit(analyze_recording, sentence, bytes(pcm))
+        with session.lock:
+            if session.streams.pop(request_id, None) is not None:
+                self.sessions.release(len(pcm))
+
+        try:
+            result = future.result()
+        except Exception as e:
+            traceback.print_exc()
+            print(f"Error analyzing audio: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+        done = time.time()
+        metrics.record('server_queue_wait', result["started"] - submitted)
+        metrics.record('server_analyze', done - submitted)
+        metrics.record('request_peak_rss_mb', result["memory"]["rss_peak_mb"])
+        timings = {"queue_wait": result["started"] - submitted, **result["timings"]}
+
+        feedback_id = uuid.uuid4().hex
+        threading.Thread(
+            target=self._stream_feedback,
+            args=(session, feedback_id, sentence, result["target_phonemes"], result["user_phonemes"], result["errors"]),
+            daemon=True,
+        ).start()
+
+        corrections = result["substituted"] + result["deleted"]
+        self.history.record(session.id, sentence, result["target_phonemes"], result["user_phonemes"],
+                            result["score"], corrections + result["inserted"], timings)
+
+        return {
+            "success": True,
+            "request_id": request_id,
+            "sentence": result["target_phonemes"],
+            "user_phonemes": result["user_phonemes"],
+            "corrections": corrections,
+            "message": "",
+            "feedback_id": feedback_id,
+            "timings": timings,
+            "memory": result["memory"],
+            "score": result["score"],
+        }
+
+
+def frontend_index():
+    """index.html with the HTTP bridge loaded ahead of the app script"""
+    with open(os.path.join(FRONTEND_DIR, "index.html"), encoding="utf-8") as f:
+        html = f.read()
+    return html.replace('<script src="script.js"', '<script src="http_bridge.js"></script>\n        <script src="script.js"', 1)
+
+
+def _non_negative_int(value):
+    """A header or query value as an int, or None when missing, malformed or negative"""
+    if value is None or not re.fullmatch(r"[0-9]+", value.strip()):
+        return None
+    return int(value)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so chunk uploads reuse one connection
+    api = None
+    index = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type, headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload, headers=()):
+        self._send(status, json.dumps(payload).encode(), "application/json", headers)
+
+    def _session(self):
+        session_id = self.headers.get("X-Session-Id", "")
+        if not SESSION_ID.match(session_id):
+            return None
+        return self.api.sessions.get(session_id)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/api/events":
+            session = self._session()
+            if session is None:
+                self._send_json(400, {"error": "Missing or invalid X-Session-Id"})
+                return
+            since = _non_negative_int(parse_qs(url.query).get("since", ["0"])[0])
+            if since is None:
+                self._send_json(400, {"error": "Invalid since"})
+                return
+            events, cursor = session.events_since(since)
+            self._send_json(200, {"events": events, "next": cursor})
+            return
+
+        if url.path in ("/", "/index.html"):
+            self._send(200, self.index, "text/html; charset=utf-8", [("Cache-Control", "no-cache")])
+            return
+
+        # Static frontend files, never anything outside the frontend directory
+        path = os.path.realpath(os.path.join(FRONTEND_DIR, unquote(url.path).lstrip("/")))
+        if not path.startswith(FRONTEND_DIR + os.sep) or not os.path.isfile(path):
+            self._send_json(404, {"error": "Not found"})
+            return
+        with open(path, "rb") as f:
+            body = f.read()
+        self._send(200, body, mimetypes.guess_type(path)[0] or "application/octet-stream")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        method = url.path[len("/api/"):] if url.path.startswith("/api/") else None
+        length = _non_negative_int(self.headers.get("Content-Length"))
+        if length is None:
+            # Without a usable length the rest of the stream can't be framed
+            self.close_connection = True
+            self._send_json(400, {"error": "Missing or invalid Content-Length"})
+            return
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self._send_json(413, {"error": "Request too large"})
+            return
+        body = self.rfile.read(length)
+
+        if method not in ServerAPI.exposed:
+            self._send_json(404, {"error": f"Unknown method: {method}"})
+            return
+        session = self._session()
+        if session is None:
+            self._send_json(400, {"error": "Missing or invalid X-Session-Id"})
+            return
+        try:
+            args = json.loads(body or b"[]")
+            if not isinstance(args, list):
+                raise ValueError("Arguments must be a JSON list")
+            result = getattr(self.api, method)(session, *args)
+        except ServerBusy:
+            self._send_json(503, {"success": False, "error": "Server busy, try again"}, [("Retry-After", "1")])
+            return
+        except (TypeError, ValueError) as e:
+            self._send_json(400, {"success": False, "error": str(e)})
+            return
+        except Exception as e:
+            traceback.print_exc()
+            self._send_json(500, {"success": False, "error": str(e)})
+            return
+        self._send_json(200, result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve SpeechTeacher to many browsers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=max((os.cpu_count() or 2) // 2, 1),
+                        help="Worker processes, each holding its own model")
+    parser.add_argument("--queue", type=int, default=None,
+                        help="Attempts allowed to wait for a worker before answering 503 (default: 2 per worker)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Attempts each worker runs at once (default: 4 with --batch-window-ms, else 1)")
+    parser.add_argument("--batch-window-ms", type=float,
+                        default=float(os.environ.get("SPEECHTEACHER_BATCH_WINDOW_MS") or 0) or None,
+                        help="Micro-batch the attempts a worker receives within this window, see pipeline.Listener")
+    parser.add_argument("--backend", default=os.environ.get("SPEECHTEACHER_BACKEND", "fp32"),
+                        help="Inference backend, see backend/inference_backends.py")
+    parser.add_argument("--scoring", default=os.environ.get("SPEECHTEACHER_SCORING", "alignment"),
+                        help="alignment or gop, see pipeline.Listener")
+    parser.add_argument("--low-memory", action="store_true",
+                        default=os.environ.get("SPEECHTEACHER_LOW_MEMORY", "0") not in ("", "0"),
+                        help="Run the workers in the Listener's low-memory mode")
+    args = parser.parse_args()
+
+    threads = args.threads or (4 if args.batch_window_ms else 1)
+    pool = WorkerPool(args.workers, 2 * args.workers if args.queue is None else args.queue, threads,
+                      backend=args.backend, scoring=args.scoring, low_memory=args.low_memory,
+                      batch_window_ms=args.batch_window_ms)
+    pool.start()
+    threading.Thread(target=viseme_assets.load, daemon=True).start()
+
+    history = HistoryStore(os.environ.get("SPEECHTEACHER_HISTORY") or os.path.join(RECORDINGS_DIR, "history.sqlite"))
+    handler = type("Handler", (Handler,), {"api": ServerAPI(pool, history), "index": frontend_index().encode()})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    print(f"Serving on http://{args.host}:{server.server_address[1]} with {args.workers} workers "
+          f"of {threads} threads")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.shutdown()
+        history.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+# backend.ctc needs the inference dependencies (torch, librosa)
+pytest.importorskip("backend.ctc")
+
+from backend.ctc import PhonemeSpans, best_path  # noqa: E402
+from backend.gop import LabelMap, forced_align, score_pronunciation  # noqa: E402
+from backend.phonemes import PhonemeString  # noqa: E402
+
+VOCABULARY = ['<pad>', 'k', 'æ', 'ɪ', 't', 's', 'ʃ', 'tʃ', 'iː', 'z', 'a', 'aɪ']
+BLANK = 0
+
+
+def posteriors(heard, certainty=0.97):
+    """Synthetic `[frames, vocab]` log-posteriors: every frame is sure of one label"""
+    ids = [VOCABULARY.index(label) for label in heard]
+    probs = np.full((len(ids), len(VOCABULARY)), (1 - certainty) / (len(VOCABULARY) - 1))
+    probs[np.arange(len(ids)), ids] = certainty
+    return np.log(probs).astype(np.float32)
+
+
+def spans_of(heard, log_probs=None):
+    log_probs = posteriors(heard) if log_probs is None else log_probs
+    ids, confidence = best_path(log_probs)
+    return PhonemeSpans.from_frames(ids, confidence, BLANK, VOCABULARY, log_probs=log_probs)
+
+
+@pytest.fixture
+def label_map():
+    return LabelMap(VOCABULARY, BLANK)
+
+
+def test_multi_character_tokens_keep_every_spelling(label_map):
+    ids = {token: i for i, token in enumerate(VOCABULARY)}
+    assert label_map.token_labels('tʃ') == ((ids['tʃ'],), (ids['t'], ids['ʃ']))
+    assert label_map.token_labels('iː') == ((ids['iː'],),)
+    assert label_map.token_labels('θ') == ()
+
+
+def test_split_spelling_is_aggregated_per_target_token(label_map):
+    heard = ['<pad>', 't', 't', 'ʃ', 'ʃ', 'ʃ', '<pad>', 'iː', 'iː', 'iː', 'z', 'z', '<pad>']
+    scores = score_pronunciation(spans_of(heard), PhonemeString("tʃˈiːz"), label_map)
+    assert scores.target.tokens == ['tʃ', 'iː', 'z']
+    assert not scores.flagged.any()
+    assert np.allclose(scores.gop, 0.0)
+    assert scores.score == 100
+    # tʃ covers the frames of both its labels
+    assert (scores.start[0], scores.end[0]) == (1, 6)
+
+
+def test_single_label_spelling_still_aligns(label_map):
+    heard = ['tʃ', 'tʃ', 'tʃ', 'iː', 'iː', 'z', 'z', '<pad>']
+    scores = score_pronunciation(spans_of(heard), PhonemeString("tʃiːz"), label_map)
+    assert not scores.flagged.any()
+    assert scores.score == 100
+
+
+def test_mispronounced_vowel_is_flagged(label_map):
+    heard = ['k', 'k', 'ɪ', 'ɪ', 'ɪ', 't', 's', 's']
+    log_probs = posteriors(heard)
+    # The model still gives the intended vowel a little weight
+    log_probs[2:5, VOCABULARY.index('æ')] = np.log(0.02)
+    scores = score_pronunciation(spans_of(heard, log_probs), PhonemeString("kæts"), label_map)
+    assert scores.flagged.tolist() == [False, True, False, False]
+    assert (scores.start[1], scores.end[1]) == (2, 5)
+
+
+def test_repeated_label_needs_a_blank_between(label_map):
+    target = label_map.encode(PhonemeString("tt"))
+    assert forced_align(posteriors(['t', 't']), target, BLANK) is None
+    tokens, _ = forced_align(posteriors(['t', 't', 't']), target, BLANK)
+    assert tokens.tolist() == [0, -1, 1]
+
+
+def test_too_short_recording_cannot_be_aligned(label_map):
+    assert forced_align(posteriors(['k']), label_map.encode(PhonemeString("kæts")), BLANK) is None
@@ -0,0 +1,42 @@
+import pytest
+
+from backend.alignment import align
+from backend.phonemes import PhonemeString, tokenize
+
+
+@pytest.mark.parametrize("target, heard", [
+    ("kˈæts", "k æ t s"),
+    ("kɪdz", "k ɪ d z"),
+    ("ðɪsɪzɪts", "ð ɪ s ɪ z ɪ t s"),
+    ("tʃˈiːz", "tʃ iː z"),
+    ("hˈɪə", "h ɪə"),
+])
+def test_recognizer_output_tokenizes_like_espeak(target, heard):
+    assert PhonemeString(heard).tokens == PhonemeString(target).tokens
+
+
+@pytest.mark.parametrize("target, heard", [
+    ("kˈæts", "k æ t s"),
+    ("kɪdz", "k ɪ d z"),
+])
+def test_align_spaced_recognizer_output(target, heard):
+    alignment = align(target, heard)
+    assert alignment.similarity == 100
+    assert not (alignment.substitutions or alignment.deletions or alignment.insertions)
+
+
+@pytest.mark.parametrize("words, heard", [
+    (["ɪt", "sˈʌn"], "ɪ t s ʌ n"),
+    (["wʌt", "ʃˈɪp"], "w ʌ t ʃ ɪ p"),
+    (["ɡʊd", "zˈuː"], "ɡ ʊ d z uː"),
+])
+def test_correct_speech_across_word_boundaries(words, heard):
+    alignment = align("".join(words), heard, words)
+    assert alignment.similarity == 100
+    assert not (alignment.substitutions or alignment.deletions or alignment.insertions)
+
+
+def test_tokens_never_cross_whitespace():
+    tokens, starts, ends = tokenize("w ʌ t ʃ")
+    assert tokens == ["w", "ʌ", "t", "ʃ"]
+    assert list(zip(starts, ends)) == [(0, 1), (2, 3), (4, 5), (6, 7)]
@@ -0,0 +1,16 @@
+from backend.phonemes import PHONEMES
+from backend.viseme_identifier import ipa_to_viseme, viseme_identifier
+
+
+def test_every_inventory_phoneme_has_a_viseme():
+    missing = [phoneme for phoneme in PHONEMES if phoneme not in ipa_to_viseme]
+    assert not missing
+
+
+def test_only_silence_maps_to_viseme_zero():
+    assert [phoneme for phoneme in PHONEMES if ipa_to_viseme[phoneme] == 0] == []
+
+
+def test_affricates_map_to_alveolar_viseme():
+    assert ipa_to_viseme["ts"] == ipa_to_viseme["dz"] == 19
+    assert viseme_identifier("kˈæts") == [(20, "k"), (1, "æ"), (19, "t"), (15, "s")]